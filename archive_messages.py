@@ -0,0 +1,5 @@
+import asyncio
+from database.partitions import archive_old_partitions
+
+if __name__ == "__main__":
+    print(asyncio.run(archive_old_partitions()))
@@ -0,0 +1,101 @@
+import time
+from typing import Optional
+
+from sqlalchemy import select, exists, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database.unit_of_work import scoped_session
+from database.models import Project, ProjectMembers, Task
+
+
+class AclCache:
+    """
+    Short-lived cache of ownership checks, grouped by project so that
+    a task or project mutation drops every answer for that project at once.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_projects: int = 10000):
+        self.ttl = ttl
+        self.max_projects = max_projects
+        self.entries: dict[int, dict[tuple, tuple[float, bool]]] = {}
+
+    def get(self, project_id: int, key: tuple) -> Optional[bool]:
+        entry = self.entries.get(project_id, {}).get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def put(self, project_id: int, key: tuple, value: bool):
+        if project_id not in self.entries and len(self.entries) >= self.max_projects:
+            self.entries.clear()
+        self.entries.setdefault(project_id, {})[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate_project(self, project_id: int):
+        self.entries.pop(project_id, None)
+
+
+acl_cache = AclCache()
+
+
+def invalidate_on_commit(session: AsyncSession, project_id: int):
+    """
+    Drop the project's answers now and again once the session really commits: inside a
+    unit of work commit() only flushes, and other requests may refill the cache from the
+    committed state until then.
+    """
+    acl_cache.invalidate_project(project_id)
+    session.info.setdefault("acl_projects", set()).add(project_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_projects(session):
+    for project_id in session.info.pop("acl_projects", ()):
+        acl_cache.invalidate_project(project_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_uncommitted_projects(session):
+    session.info.pop("acl_projects", None)
+
+
+async def is_project_owner(project_id: int, user_id: int) -> bool:
+    key = ("owner", user_id)
+    allowed = acl_cache.get(project_id, key)
+    if allowed is None:
+        query = select(exists().where(Project.id == project_id, Project.owner_id == user_id))
+        async with scoped_session() as session:
+            allowed = (await session.execute(query)).scalar()
+        acl_cache.put(project_id, key, allowed)
+    return allowed
+
+
+async def is_project_member(project_id: int, user_id: int) -> bool:
+    key = ("member", user_id)
+    allowed = acl_cache.get(project_id, key)
+    if allowed is None:
+        query = select(exists().where(ProjectMembers.project_id == project_id, ProjectMembers.user_id == user_id))
+        async with scoped_session() as session:
+            allowed = (await session.execute(query)).scalar()
+        acl_cache.put(project_id, key, allowed)
+    return allowed
+
+
+async def owns_task(project_id: int, task_id: int, user_id: int) -> bool:
+    """True when the user owns the project and the task belongs to it."""
+    key = ("task", user_id, task_id)
+    allowed = acl_cache.get(project_id, key)
+    if allowed is None:
+        query = select(exists().where(Task.id == task_id, Task.project_id == project_id,
+                                      Project.id == Task.project_id, Project.owner_id == user_id))
+        async with scoped_session() as session:
+            allowed = (await session.execute(query)).scalar()
+        acl_cache.put(project_id, key, allowed)
+    return allowed
+
+
+async def is_task_member(task_id: int, user_id: int) -> bool:
+    """True when the task exists and the user is a member of its project."""
+    async with scoped_session() as session:
+        project_id = (await session.execute(select(Task.project_id).where(Task.id == task_id))).scalar()
+    return project_id is not None and await is_project_member(project_id, user_id)
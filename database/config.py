@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -17,11 +18,33 @@ class Settings(BaseSettings):
     DB_USER: str
     DB_PASS: str
     DB_NAME: str
+    ARCHIVE_DIR: str = "archive"
+    MESSAGE_PARTITIONS_AHEAD: int = 3
+    MESSAGE_RETENTION_MONTHS: int = 12
+    # How often the lease holder makes sure the next MESSAGE_PARTITIONS_AHEAD months exist
+    PARTITION_CHECK_HOURS: int = 6
+    DB_REPLICA_HOST: Optional[str] = None
+    DB_REPLICA_PORT: Optional[int] = None
+    READ_YOUR_WRITES_SECONDS: float = 5.0
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    # Connections opened and warmed at startup, defaults to DB_POOL_SIZE
+    DB_POOL_PREFILL: Optional[int] = None
+    # SQLAlchemy compiled statement cache and asyncpg prepared statement cache (per connection)
+    QUERY_CACHE_SIZE: int = 1200
+    STATEMENT_CACHE_SIZE: int = 500
 
     @property
     def database_url(self):
         return (f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/"
                 f"{self.DB_NAME}")
 
+    @property
+    def replica_url(self):
+        if not self.DB_REPLICA_HOST:
+            return None
+        return (f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_REPLICA_HOST}:"
+                f"{self.DB_REPLICA_PORT or self.DB_PORT}/{self.DB_NAME}")
+
 
 config = Settings()
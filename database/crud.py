@@ -1,15 +1,21 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
 
 from fastapi import HTTPException
-from sqlalchemy import select, delete
+from sqlalchemy import select, insert, delete, update, literal, func, or_, case, union, exists, true, BigInteger
 from fastapi_mail import FastMail, MessageSchema
-from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload, aliased
 
 from database import schemas
 from database.database_init import engine, Base
-from database.models import User, Chat, Project, Task, TaskStatus, Message, Reaction, MessageType, Comment
-from database.database_init import session_factory
+from database.models import User, Chat, Project, Task, TaskStatus, Message, Reaction, MessageType, Comment, \
+    ChatMember, TaskAssigned, UploadSession, ProjectStats, ProjectMembers
+from database.unit_of_work import scoped_session, commit
+from database.acl import invalidate_on_commit
+from database.partitions import ensure_message_partitions, read_archived_messages
+from database.stats import adjust_stats
+from scheduler.reminders import deadline_changed
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -22,10 +28,11 @@ class AsyncORM:
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.drop_all)
             await conn.run_sync(Base.metadata.create_all)
+            await ensure_message_partitions(conn)
 
     @staticmethod
-    async def get_user_by_email(email: str):
-        async with (session_factory() as session):
+    async def get_user_by_email(email: str, session: Optional[AsyncSession] = None):
+        async with (scoped_session(session) as session):
             # query = (select(User)
             #         .options(
             #    selectinload(User.projects)
@@ -34,7 +41,6 @@ class AsyncORM:
             #    .selectinload(Project.owner),
             #    selectinload(User.chats),
             #    selectinload(User.projects).selectinload(Project.tasks).selectinload(Task.assigned),
-            #    selectinload(User.projects).selectinload(Project.tasks).selectinload(Task.comments)
             # )
             #         .where(User.email == email))
             query = select(User).where(User.email == email)
@@ -42,65 +48,89 @@ class AsyncORM:
         return res.unique().scalars().first()
 
     @staticmethod
-    async def get_user_by_id(id: int):
-        async with (session_factory() as session):
+    async def get_user_by_id(id: int, session: Optional[AsyncSession] = None):
+        async with (scoped_session(session, read=True) as session):
             query = select(User).where(User.id == id)
             res = await session.execute(query)
         return res.unique().scalars().first()
 
     @staticmethod
-    async def get_users_projects(id: int):
-        async with session_factory() as session:
+    async def search_users(user_id: int, q: str, limit: int, session: Optional[AsyncSession] = None):
+        """
+        Users sharing a project or chat with user_id whose name or email matches q.
+        Prefix matches rank first, then trigram similarity on Postgres.
+        """
+        async with scoped_session(session, read=True) as session:
+            my_projects = select(ProjectMembers.project_id).where(ProjectMembers.user_id == user_id)
+            my_chats = select(ChatMember.chat_id).where(ChatMember.user_id == user_id)
+            peers = union(select(ProjectMembers.user_id).where(ProjectMembers.project_id.in_(my_projects)),
+                          select(ChatMember.user_id).where(ChatMember.chat_id.in_(my_chats)))
+            columns = (User.first_name, User.second_name, User.email)
+            pattern = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            prefix = or_(*(column.ilike(f"{pattern}%", escape="\\") for column in columns))
+            query = select(User).where(User.id.in_(peers), User.id != user_id)
+            if session.bind.dialect.name == "postgresql":
+                contains = (column.ilike(f"%{pattern}%", escape="\\") for column in columns)
+                fuzzy = (column.op("%")(q) for column in columns)
+                score = func.greatest(*(func.similarity(column, q) for column in columns))
+                query = query.where(or_(*contains, *fuzzy)).order_by(case((prefix, 0), else_=1), score.desc())
+            else:
+                # SQLite's LIKE is already case-insensitive and can use the NOCASE indexes, lower() could not
+                query = query.where(or_(*(column.like(f"{pattern}%", escape="\\") for column in columns)))
+            query = query.order_by(User.id).limit(limit)
+            return (await session.execute(query)).scalars().all()
+
+    @staticmethod
+    async def get_users_projects(id: int, session: Optional[AsyncSession] = None):
+        async with scoped_session(session, read=True) as session:
             query = select(User).options(selectinload(User.projects).selectinload(
                 Project.tasks),
                 selectinload(User.projects).selectinload(Project.owner), selectinload(User.projects).selectinload(
                     Project.tasks).selectinload(Task.assigned), selectinload(User.projects).selectinload(
-                    Project.tasks).selectinload(Task.comments), selectinload(User.projects).selectinload(
-                    Project.members), selectinload(User.projects).selectinload(
-                    Project.tasks).selectinload(Task.comments).selectinload(Comment.sender)
+                    Project.members)
             ).where(User.id == id)
             user_db = await session.execute(query)
             user = user_db.scalars().first()
             return user
 
     @staticmethod
-    async def create_user(user: schemas.UserCreate, confirmation_code: str):
-        async with session_factory() as session:
+    async def create_user(user: schemas.UserCreate, confirmation_code: str, session: Optional[AsyncSession] = None):
+        async with scoped_session(session) as session:
             user_db = User(email=user.email, hashed_password=pwd_context.hash(user.password), is_active=False,
                            confirmation_code=confirmation_code,
                            is_online=False
                            )
             session.add(user_db)
-            await session.commit()
+            await commit(session)
             await session.refresh(user_db)
             user_db.first_name = "User"
             user_db.second_name = f"{user_db.id}"
-            await session.commit()
+            await commit(session)
 
     @staticmethod
-    async def confirm_user(email: str):
-        async with session_factory() as session:
+    async def confirm_user(email: str, session: Optional[AsyncSession] = None):
+        async with scoped_session(session) as session:
             query = select(User).where(User.email == email)
             res = await session.execute(query)
             user = res.scalars().first()
             user.confirmation_code = None
             user.is_active = True
-            await session.commit()
+            await commit(session)
 
     @staticmethod
-    async def update_online(id: int, value: bool):
-        async with session_factory() as session:
+    async def update_online(id: int, value: bool, session: Optional[AsyncSession] = None):
+        async with scoped_session(session) as session:
             query = select(User).where(User.id == id)
             res = await session.execute(query)
             user = res.scalars().first()
             user.is_online = value
-            await session.commit()
+            await commit(session)
             await session.refresh(user)
             return user
 
     @staticmethod
-    async def get_all_chats(id: int):
-        async with session_factory() as session:
+    async def get_all_chats(id: int, session: Optional[AsyncSession] = None):
+        async with scoped_session(session, read=True) as session:
             query = select(User).options(
                 selectinload(User.chats),
                 selectinload(User.chats).selectinload(Chat.members),
@@ -113,20 +143,23 @@ class AsyncORM:
             return user.scalars().first()
 
     @staticmethod
-    async def create_chat(name, members, photo, type):
-        async with session_factory() as session:
-            users = []
-            for id in members:
-                user = await AsyncORM.get_user_by_id(id)
-                if not user:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Incorrect user info"
-                    )
-                users.append(user)
+    async def get_user_chat_ids(user_id: int, session: Optional[AsyncSession] = None) -> list[int]:
+        async with scoped_session(session) as session:
+            query = select(ChatMember.chat_id).where(ChatMember.user_id == user_id)
+            return (await session.execute(query)).scalars().all()
+
+    @staticmethod
+    async def create_chat(name, members, photo, type, session: Optional[AsyncSession] = None):
+        async with scoped_session(session) as session:
+            users = (await session.execute(select(User).where(User.id.in_(members)))).scalars().all()
+            if len(users) != len(set(members)):
+                raise HTTPException(
+                    status_code=400,
+                    detail="Incorrect user info"
+                )
             chat = Chat(name=name, members=users, photo=photo, messages=[], type=type)
             session.add(chat)
-            await session.commit()
+            await commit(session)
             await session.refresh(chat)
             query = select(Chat).options(selectinload(Chat.members),
                                          selectinload(Chat.messages),
@@ -134,8 +167,8 @@ class AsyncORM:
             return (await session.execute(query)).scalars().first()
 
     @staticmethod
-    async def create_project(project: schemas.ProjectCreate, owner_id: int):
-        async with session_factory() as session:
+    async def create_project(project: schemas.ProjectCreate, owner_id: int, session: Optional[AsyncSession] = None):
+        async with scoped_session(session) as session:
             query = select(User).where(User.id == owner_id).options(selectinload(User.my_projects)).options(
                 selectinload(User.projects))
             result = await session.execute(query)
@@ -143,9 +176,11 @@ class AsyncORM:
             project_db = Project(name=project.name, color=project.color)
             user.my_projects.append(project_db)
             user.projects.append(project_db)
-            await session.commit()
-            await session.refresh(user)
-            project_id = user.projects[-1].id
+            await session.flush()
+            session.add(ProjectStats(project_id=project_db.id, todo=0, inprogress=0, completed=0))
+            invalidate_on_commit(session, project_db.id)
+            await commit(session)
+            project_id = project_db.id
             project_out = await session.execute(select(Project)
                                                 .options(selectinload(Project.owner),
                                                          selectinload(Project.tasks))
@@ -153,8 +188,8 @@ class AsyncORM:
             return project_out.scalars().first()
 
     @staticmethod
-    async def create_task(task: schemas.TaskCreate, project_id: int):
-        async with session_factory() as session:
+    async def create_task(task: schemas.TaskCreate, project_id: int, session: Optional[AsyncSession] = None):
+        async with scoped_session(session) as session:
             assigned = []
             for user_id in task.assigned:
                 search_user = select(User).options(selectinload(User.projects).load_only(Project.id)).where(User.id ==
@@ -170,14 +205,34 @@ class AsyncORM:
                             project_id=project_id, status=TaskStatus.todo, time_end=task.time_end,
                             time_start=task.time_start)
             session.add(new_task)
-            await session.commit()
-            query = select(Task).options(selectinload(Task.assigned), selectinload(Task.comments))
+            await session.flush()
+            await deadline_changed(session, new_task.id)
+            await adjust_stats(session, project_id, {TaskStatus.todo: 1})
+            invalidate_on_commit(session, project_id)
+            await commit(session)
+            query = select(Task).options(selectinload(Task.assigned)).where(Task.id == new_task.id)
             task_db = (await session.execute(query)).scalars().first()
             return task_db
 
     @staticmethod
-    async def add_user_to_prj(project_id: int, email: str):
-        async with session_factory() as session:
+    async def get_calendar(user_id: int, time_from: datetime, time_to: datetime,
+                           session: Optional[AsyncSession] = None):
+        async with scoped_session(session, read=True) as session:
+            if session.bind.dialect.name == "postgresql":
+                overlaps = func.tstzrange(Task.time_start, Task.time_end, "[]").op("&&")(
+                    func.tstzrange(time_from, time_to, "[)"))
+            else:
+                overlaps = (Task.time_start < time_to) & (Task.time_end >= time_from)
+            query = (select(Task)
+                     .join(TaskAssigned, TaskAssigned.task_id == Task.id)
+                     .options(selectinload(Task.assigned))
+                     .where(TaskAssigned.user_id == user_id, overlaps)
+                     .order_by(Task.time_start))
+            return (await session.execute(query)).scalars().all()
+
+    @staticmethod
+    async def add_user_to_prj(project_id: int, email: str, session: Optional[AsyncSession] = None):
+        async with scoped_session(session) as session:
             query = select(User).where(User.email == email)
             user_db = await session.execute(query)
             user = user_db.scalars().first()
@@ -202,11 +257,12 @@ class AsyncORM:
                 )
             project.members.append(user)
             session.add(project)
-            await session.commit()
+            invalidate_on_commit(session, project_id)
+            await commit(session)
 
     @staticmethod
-    async def remove_task(task_id: int):
-        async with session_factory() as session:
+    async def remove_task(task_id: int, session: Optional[AsyncSession] = None):
+        async with scoped_session(session) as session:
             query = select(Task).where(Task.id == task_id)
             task_db = await session.execute(query)
             task = task_db.scalars().first()
@@ -216,15 +272,18 @@ class AsyncORM:
                     detail="Task not found"
                 )
             await session.delete(task)
-            await session.commit()
+            await deadline_changed(session, task_id)
+            await adjust_stats(session, task.project_id, {task.status: -1})
+            invalidate_on_commit(session, task.project_id)
+            await commit(session)
 
     @staticmethod
-    async def update_task(task_id: int, task_in: schemas.TaskUpdate):
-        async with session_factory() as session:
-            query = select(Task).options(selectinload(Task.assigned), selectinload(Task.comments)
-                                         ).where(Task.id == task_id)
+    async def update_task(task_id: int, task_in: schemas.TaskUpdate, session: Optional[AsyncSession] = None):
+        async with scoped_session(session) as session:
+            query = select(Task).options(selectinload(Task.assigned)).where(Task.id == task_id)
             task_db = await session.execute(query)
             task = task_db.scalars().first()
+            previous = {"assigned": {user.id for user in task.assigned}, "status": task.status}
             if task_in.assigned:
                 users = []
                 for i in task_in.assigned:
@@ -247,41 +306,247 @@ class AsyncORM:
                 task.time_end = task_in.time_end
             if task_in.status:
                 task.status = TaskStatus[task_in.status]
+            if not schemas.time_range_valid(task.time_start, task.time_end):
+                raise HTTPException(
+                    status_code=422,
+                    detail="time_end must not be before time_start"
+                )
             session.add(task)
-            await session.commit()
+            if task_in.time_end or task_in.status:
+                await deadline_changed(session, task_id)
+            if task.status != previous["status"]:
+                await adjust_stats(session, task.project_id, {previous["status"]: -1, task.status: 1})
+            await commit(session)
             await session.refresh(task)
-            return task
+            return task, previous
+
+    @staticmethod
+    async def get_task_audience(task_id: int, session: Optional[AsyncSession] = None) -> set[int]:
+        """Ids of users assigned to the task plus the project owner."""
+        async with scoped_session(session, read=True) as session:
+            assigned = await session.execute(select(TaskAssigned.user_id).where(TaskAssigned.task_id == task_id))
+            owner = await session.execute(select(Project.owner_id).join(Task, Task.project_id == Project.id)
+                                          .where(Task.id == task_id))
+            return set(assigned.scalars().all()) | set(owner.scalars().all())
 
     @staticmethod
     async def create_message(content: Optional[str], file_path: Optional[str], sender_id: int, chat_id: int,
-                             type: str) -> tuple[datetime, int]:
-        async with session_factory() as session:
+                             type: str, session: Optional[AsyncSession] = None) -> tuple[datetime, int]:
+        async with scoped_session(session) as session:
             new_message = Message(content=content, file_path=file_path, user_id=sender_id, chat_id=chat_id,
                                   type=MessageType[type])
             session.add(new_message)
-            await session.commit()
+            await commit(session)
             await session.refresh(new_message)
             return new_message.timestamp, new_message.id
 
     @staticmethod
-    async def get_single_chat(chat_id: int):
-        async with session_factory() as session:
+    async def create_upload_session(upload_id: str, user_id: int, chat_id: int, filename: str, path: str,
+                                    size: int, session: Optional[AsyncSession] = None) -> UploadSession:
+        async with scoped_session(session) as session:
+            upload = UploadSession(id=upload_id, user_id=user_id, chat_id=chat_id, filename=filename, path=path,
+                                   size=size, offset=0)
+            session.add(upload)
+            await commit(session)
+            return upload
+
+    @staticmethod
+    async def get_upload_session(upload_id: str, user_id: int,
+                                 session: Optional[AsyncSession] = None) -> UploadSession:
+        async with scoped_session(session) as session:
+            query = select(UploadSession).where(UploadSession.id == upload_id, UploadSession.user_id == user_id)
+            upload = (await session.execute(query)).scalars().first()
+            if upload is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail="Upload not found"
+                )
+            return upload
+
+    @staticmethod
+    async def advance_upload_session(upload_id: str, offset: int, written: int,
+                                     session: Optional[AsyncSession] = None) -> bool:
+        """Move the offset forward only if nobody else has moved it since `offset` was read."""
+        async with scoped_session(session) as session:
+            res = await session.execute(update(UploadSession)
+                                        .where(UploadSession.id == upload_id, UploadSession.offset == offset)
+                                        .values(offset=offset + written,
+                                                updated_at=func.timezone("utc", func.now())))
+            await commit(session)
+            return res.rowcount == 1
+
+    @staticmethod
+    async def delete_upload_session(upload_id: str, session: Optional[AsyncSession] = None) -> bool:
+        async with scoped_session(session) as session:
+            res = await session.execute(delete(UploadSession).where(UploadSession.id == upload_id))
+            await commit(session)
+            return res.rowcount == 1
+
+    @staticmethod
+    async def delete_stale_upload_sessions(before: datetime, session: Optional[AsyncSession] = None) -> list[str]:
+        """Remove sessions idle since `before` and return their partial file paths."""
+        async with scoped_session(session) as session:
+            res = await session.execute(delete(UploadSession).where(UploadSession.updated_at < before)
+                                        .returning(UploadSession.path))
+            paths = res.scalars().all()
+            await commit(session)
+            return paths
+
+    @staticmethod
+    async def get_single_chat(chat_id: int, session: Optional[AsyncSession] = None):
+        async with scoped_session(session, read=True) as session:
             query = select(Chat).where(Chat.id == chat_id)
             res = await session.execute(query)
             chat = res.scalars().first()
             return chat
 
     @staticmethod
-    async def create_reaction(reaction: int, message_id, user_id):
-        async with session_factory() as session:
+    async def get_chat_history(chat_id: int, user_id: int, before: Optional[datetime], limit: int,
+                               session: Optional[AsyncSession] = None):
+        if before is not None and before.tzinfo is not None:
+            before = before.astimezone(timezone.utc).replace(tzinfo=None)
+        async with scoped_session(session, read=True) as session:
+            member = await session.execute(select(ChatMember).where(ChatMember.chat_id == chat_id,
+                                                                    ChatMember.user_id == user_id))
+            if member.scalars().first() is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail="Chat not found"
+                )
+            query = (select(Message).options(selectinload(Message.reactions).selectinload(Reaction.sender))
+                     .where(Message.chat_id == chat_id)
+                     .order_by(Message.timestamp.desc())
+                     .limit(limit))
+            if before is not None:
+                query = query.where(Message.timestamp < before)
+            messages = list((await session.execute(query)).scalars().all())
+        if len(messages) < limit:
+            oldest = messages[-1].timestamp if messages else before
+            messages.extend(await read_archived_messages(chat_id, oldest, limit - len(messages)))
+        return messages
+
+    @staticmethod
+    async def create_reaction(reaction: int, message_id, user_id, chat_id: int,
+                              session: Optional[AsyncSession] = None) -> bool:
+        """
+        Add a reaction to a message of the chat. Returns False when the chat has no such
+        message: reactions.message_id has no FK since messages became partitioned.
+        """
+        async with scoped_session(session) as session:
+            if not await AsyncORM.chat_message_ids(chat_id, [message_id], session=session):
+                return False
             new_reaction = Reaction(content=reaction, message_id=message_id, user_id=user_id)
             session.add(new_reaction)
-            await session.commit()
+            await commit(session)
+            return True
+
+    @staticmethod
+    async def chat_message_ids(chat_id: int, message_ids: list[int], session: Optional[AsyncSession] = None) -> set[int]:
+        """The ids among `message_ids` of messages that exist in the chat."""
+        async with scoped_session(session, read=True) as session:
+            query = select(Message.id).where(Message.chat_id == chat_id, Message.id.in_(message_ids))
+            return set((await session.execute(query)).scalars().all())
+
+    @staticmethod
+    async def create_messages(rows: list[dict], session: Optional[AsyncSession] = None) -> list[tuple[int, datetime]]:
+        """Insert text messages (user_id, chat_id, content) in one statement, returning (id, timestamp) in order."""
+        async with scoped_session(session) as session:
+            result = await session.execute(
+                insert(Message).returning(Message.id, Message.timestamp, sort_by_parameter_order=True),
+                [{"type": MessageType.text, "file_path": None, "read_id": [], **row} for row in rows]
+            )
+            created = [(row.id, row.timestamp) for row in result]
+            await commit(session)
+            return created
 
     @staticmethod
-    async def create_comment(content: str, user_id: int, task_id: int):
-        async with session_factory() as session:
-            new_comment = Comment(content=content, sender_id=user_id, task_id=task_id)
+    async def create_reactions(rows: list[dict], session: Optional[AsyncSession] = None):
+        """Insert reactions (content, message_id, user_id) in one statement; check message ids with chat_message_ids."""
+        async with scoped_session(session) as session:
+            await session.execute(insert(Reaction), rows)
+            await commit(session)
+
+    @staticmethod
+    async def mark_read(user_id: int, chat_id: int, message_ids: list[int],
+                        session: Optional[AsyncSession] = None) -> set[int]:
+        """Add the user to read_id of the chat's given messages. Returns the ids that exist in the chat."""
+        async with scoped_session(session) as session:
+            query = select(Message).where(Message.chat_id == chat_id, Message.id.in_(message_ids))
+            messages = (await session.execute(query)).scalars().all()
+            for message in messages:
+                if user_id not in message.read_id:
+                    message.read_id = message.read_id + [user_id]
+            await commit(session)
+            return {message.id for message in messages}
+
+    @staticmethod
+    async def create_comment(content: str, user_id: int, task_id: int, parent_comment_id: Optional[int] = None,
+                             session: Optional[AsyncSession] = None):
+        async with scoped_session(session) as session:
+            if parent_comment_id is not None:
+                query = select(Comment.task_id).where(Comment.id == parent_comment_id)
+                parent_task_id = (await session.execute(query)).scalars().first()
+                if parent_task_id != task_id:
+                    raise HTTPException(
+                        status_code=404,
+                        detail="Parent comment not found"
+                    )
+            new_comment = Comment(content=content, sender_id=user_id, task_id=task_id,
+                                  parent_comment_id=parent_comment_id)
             session.add(new_comment)
-            await session.commit()
+            await commit(session)
+
+    @staticmethod
+    async def get_comment_thread(task_id: int, parent_id: Optional[int], offset: int, limit: int, max_depth: int,
+                                 max_replies: int, session: Optional[AsyncSession] = None):
+        """
+        One page of comments under `parent_id` (top level when None) with their first
+        `max_replies` replies per comment down to `max_depth`, loaded with a single recursive
+        CTE. has_more_replies marks comments whose remaining replies are paged with parent_id.
+        """
+        async with scoped_session(session, read=True) as session:
+            page = (select(Comment.id)
+                    .where(Comment.task_id == task_id, Comment.parent_comment_id == parent_id)
+                    .order_by(Comment.timestamp, Comment.id)
+                    .offset(offset)
+                    .limit(limit))
+            thread = (select(Comment.id, literal(0).label("depth"), literal(0, BigInteger).label("rank"))
+                      .where(Comment.id.in_(page.scalar_subquery()))
+                      .cte("thread", recursive=True))
+            # One row past the cap tells that a comment has more replies; it is not descended into
+            replies = (select(Comment.id, func.row_number().over(order_by=(Comment.timestamp, Comment.id)).label("rank"))
+                       .where(Comment.parent_comment_id == thread.c.id)
+                       .order_by(Comment.timestamp, Comment.id)
+                       .limit(max_replies + 1)
+                       .lateral("replies"))
+            thread = thread.union_all(
+                select(replies.c.id, (thread.c.depth + 1).label("depth"), replies.c.rank)
+                .select_from(thread)
+                .join(replies, true())
+                .where(thread.c.depth < max_depth, thread.c.rank <= max_replies)
+            )
+            reply = aliased(Comment)
+            query = (select(Comment, thread.c.depth, thread.c.rank,
+                            (thread.c.depth == max_depth) & exists().where(reply.parent_comment_id == Comment.id))
+                     .join(thread, Comment.id == thread.c.id)
+                     .options(joinedload(Comment.sender))
+                     .order_by(Comment.timestamp, Comment.id))
+            rows = (await session.execute(query)).all()
+        nodes, more = {}, set()
+        for comment, depth, rank, deeper in rows:
+            if rank > max_replies:
+                more.add(comment.parent_comment_id)
+                continue
+            nodes[comment.id] = {"id": comment.id, "content": comment.content, "task_id": comment.task_id,
+                                 "parent_comment_id": comment.parent_comment_id, "timestamp": comment.timestamp,
+                                 "sender": comment.sender, "depth": depth, "replies": [], "has_more_replies": deeper}
+        roots = []
+        for node in nodes.values():
+            node["has_more_replies"] = node["has_more_replies"] or node["id"] in more
+            parent = nodes.get(node["parent_comment_id"])
+            if node["depth"] and parent:
+                parent["replies"].append(node)
+            else:
+                roots.append(node)
+        return roots
 
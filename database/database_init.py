@@ -1,22 +1,146 @@
-from typing import Generator
+import time
+from contextvars import ContextVar
+from typing import Generator, Optional, TYPE_CHECKING
 
 import pydantic
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
-from sqlalchemy.orm import DeclarativeBase, MappedAsDataclass
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import DeclarativeBase, MappedAsDataclass, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from database.config import config
+from monitoring.metrics import pool_wait, count_checkout
+from monitoring.admission import controller as admission
+
+if TYPE_CHECKING:
+    from database.unit_of_work import UnitOfWork
+
+
+class TimedPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long each checkout waited for a connection, also for admission
+    control. A checkout waits only when every connection the pool may hold is in use or promised
+    to an earlier checkout still in flight; opening a new connection is not waiting.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = 0
+        self._connecting = 0
+
+    def _exhausted(self) -> bool:
+        if self._max_overflow < 0:
+            return False
+        return self.checkedout() - self._connecting + self._pending >= self.size() + self._max_overflow
+
+    def _create_connection(self):
+        self._connecting += 1
+        try:
+            return super()._create_connection()
+        finally:
+            self._connecting -= 1
+
+    def _do_get(self):
+        count_checkout()
+        exhausted = self._exhausted()
+        start = time.perf_counter()
+        self._pending += 1
+        admission.waiting += exhausted
+        try:
+            return super()._do_get()
+        finally:
+            self._pending -= 1
+            admission.waiting -= exhausted
+            waited = time.perf_counter() - start if exhausted else 0.0
+            pool_wait.observe(waited)
+            admission.pool_wait.record(waited)
+
+
+POOL_OPTIONS = dict(
+    poolclass=TimedPool,
+    pool_size=config.DB_POOL_SIZE,
+    max_overflow=config.DB_MAX_OVERFLOW,
+    query_cache_size=config.QUERY_CACHE_SIZE,
+    connect_args={"prepared_statement_cache_size": config.STATEMENT_CACHE_SIZE},
+)
 
 engine = create_async_engine(
     url=config.database_url,
     echo=True,
+    **POOL_OPTIONS,
 )
 
 session_factory = async_sessionmaker(engine, expire_on_commit=False)
 
+replica_engine = create_async_engine(
+    url=config.replica_url,
+    echo=True,
+    **POOL_OPTIONS,
+) if config.replica_url else None
+
+replica_session_factory = async_sessionmaker(replica_engine, expire_on_commit=False) if replica_engine else None
+
+# User the current request or socket event acts for, set during authentication
+current_user_id: ContextVar[Optional[int]] = ContextVar("current_user_id", default=None)
+# Unit of work (see database.unit_of_work) shared by everything inside the current request or socket event
+current_unit: ContextVar[Optional["UnitOfWork"]] = ContextVar("current_unit", default=None)
+# user id -> monotonic time of their last committed write on the primary
+recent_writes: dict[int, float] = {}
+
+
+@event.listens_for(Session, "after_flush")
+def _flag_flush(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _flag_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_write(session):
+    session.info.pop("wrote", None)
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_write(session):
+    if session.info.pop("wrote", False):
+        user_id = current_user_id.get()
+        if user_id is not None:
+            now = time.monotonic()
+            recent_writes[user_id] = now
+            if len(recent_writes) > 10000:
+                cutoff = now - config.READ_YOUR_WRITES_SECONDS
+                for stale in [uid for uid, at in recent_writes.items() if at < cutoff]:
+                    del recent_writes[stale]
+
+
+def read_session() -> AsyncSession:
+    """
+    Session for read-only queries. Goes to the replica when one is configured,
+    unless the current user committed a write within READ_YOUR_WRITES_SECONDS.
+    """
+    if replica_session_factory is None:
+        return session_factory()
+    user_id = current_user_id.get()
+    wrote_at = recent_writes.get(user_id) if user_id is not None else None
+    if wrote_at is not None and time.monotonic() - wrote_at < config.READ_YOUR_WRITES_SECONDS:
+        return session_factory()
+    session = replica_session_factory()
+    session.info["replica"] = True
+    return session
+
 
 class Base(DeclarativeBase):
     pass
 
 
 async def get_db() -> Generator:
+    unit = current_unit.get()
+    session = unit.get(read=unit.read_only) if unit is not None else None
+    if session is not None:
+        yield session
+        return
     async with session_factory() as session:
         yield session
@@ -0,0 +1,146 @@
+import asyncio
+import itertools
+import json
+import os
+import zipfile
+from typing import AsyncIterator, Iterator, Optional
+
+from sqlalchemy import select
+
+from database.database_init import read_session
+from database.models import Message, MessageArchive, Reaction
+from database.partitions import iter_archive, iter_archive_by_time
+
+EXPORT_BATCH = 500
+
+
+def _attachment(file_path: Optional[str]) -> Optional[dict]:
+    if not file_path:
+        return None
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        size = None
+    return {"path": file_path, "filename": os.path.basename(file_path), "size": size}
+
+
+def _archived_rows(paths: list[str], chat_id: Optional[int], user_id: Optional[int]) -> Iterator[dict]:
+    """Archived messages month by month in export order, converted to the export row format."""
+    for path in paths:
+        # A sender's messages are spread over the file's chat-ordered runs
+        rows = iter_archive(path, chat_id, user_id) if chat_id is not None else iter_archive_by_time(path, user_id)
+        for row in rows:
+            yield {
+                "id": row["id"],
+                "chat_id": row["chat_id"],
+                "user_id": row["user_id"],
+                "timestamp": row["timestamp"],
+                "type": row["type"],
+                "content": row["content"],
+                "attachment": _attachment(row["file_path"]),
+                "read_id": row["read_id"],
+                "reactions": [{"content": reaction["content"], "user_id": reaction["sender"]["id"]}
+                              for reaction in row["reactions"]],
+            }
+
+
+async def export_archived(chat_id: Optional[int], user_id: Optional[int],
+                          batch_size: int = EXPORT_BATCH) -> AsyncIterator[list[dict]]:
+    """Yield the messages of archived months, oldest first, reading the NDJSON files off the event loop."""
+    async with read_session() as session:
+        paths = (await session.execute(select(MessageArchive.path).order_by(MessageArchive.month))).scalars().all()
+    rows = _archived_rows(list(paths), chat_id, user_id)
+    while batch := await asyncio.to_thread(lambda: list(itertools.islice(rows, batch_size))):
+        yield batch
+
+
+async def export_messages(chat_id: Optional[int] = None, user_id: Optional[int] = None,
+                          batch_size: int = EXPORT_BATCH) -> AsyncIterator[list[dict]]:
+    """
+    Yield a chat's (or a sender's) messages in batches: archived months first, then the live
+    partitions through a server-side cursor. Reactions and attachment metadata are fetched
+    once per batch.
+    """
+    async for batch in export_archived(chat_id, user_id, batch_size):
+        yield batch
+    query = (select(Message.id, Message.chat_id, Message.user_id, Message.timestamp, Message.type,
+                    Message.content, Message.file_path, Message.read_id)
+             .order_by(Message.timestamp, Message.id)
+             .execution_options(yield_per=batch_size))
+    if chat_id is not None:
+        query = query.where(Message.chat_id == chat_id)
+    if user_id is not None:
+        query = query.where(Message.user_id == user_id)
+    async with read_session() as session:
+        result = await session.stream(query)
+        async for rows in result.partitions():
+            ids = [row.id for row in rows]
+            reactions: dict[int, list[dict]] = {}
+            reaction_rows = await session.execute(
+                select(Reaction.message_id, Reaction.content, Reaction.user_id).where(Reaction.message_id.in_(ids))
+            )
+            for reaction in reaction_rows:
+                reactions.setdefault(reaction.message_id, []).append(
+                    {"content": reaction.content, "user_id": reaction.user_id}
+                )
+            attachments = await asyncio.to_thread(lambda: [_attachment(row.file_path) for row in rows])
+            yield [
+                {
+                    "id": row.id,
+                    "chat_id": row.chat_id,
+                    "user_id": row.user_id,
+                    "timestamp": row.timestamp.isoformat(),
+                    "type": row.type.value,
+                    "content": row.content,
+                    "attachment": attachment,
+                    "read_id": row.read_id,
+                    "reactions": reactions.get(row.id, []),
+                }
+                for row, attachment in zip(rows, attachments)
+            ]
+
+
+async def ndjson_stream(batches: AsyncIterator[list[dict]]) -> AsyncIterator[bytes]:
+    async for batch in batches:
+        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in batch).encode("utf-8")
+
+
+class _ZipSink:
+    """Write-only buffer for zipfile. No tell(), so zipfile streams entries with data descriptors."""
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+async def zip_json_stream(batches: AsyncIterator[list[dict]], name: str = "history.json") -> AsyncIterator[bytes]:
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED)
+    entry = archive.open(name, "w", force_zip64=True)
+    entry.write(b"[")
+    first = True
+    async for batch in batches:
+        for row in batch:
+            entry.write((b"" if first else b",") + json.dumps(row, ensure_ascii=False).encode("utf-8"))
+            first = False
+        yield sink.drain()
+    entry.write(b"]")
+    entry.close()
+    archive.close()
+    yield sink.drain()
+
+
+EXPORT_FORMATS = {
+    "ndjson": (ndjson_stream, "application/x-ndjson", "ndjson"),
+    "zip": (zip_json_stream, "application/zip", "zip"),
+}
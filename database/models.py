@@ -1,7 +1,7 @@
 import datetime
 import enum
 from typing import Annotated, Optional
-from sqlalchemy import String, ForeignKey, DateTime, JSON, func, text
+from sqlalchemy import String, ForeignKey, DateTime, Date, JSON, Index, BigInteger, DDL, event, func, text
 
 from database.database_init import Base
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -27,12 +27,24 @@ class User(Base):
     reactions: Mapped[list["Reaction"]] = relationship(back_populates="sender")
     tasks: Mapped[list["Task"]] = relationship(back_populates="assigned", secondary="task_assigned")
     comments: Mapped[list["Comment"]] = relationship(back_populates="sender")
+    # Upper bound (UTC, like message timestamps) of the unread messages covered by the last digest
+    last_digest_at: Mapped[Optional[datetime.datetime]] = mapped_column(nullable=True)
+
+
+# Directory search: trigram GIN indexes for substring and fuzzy matches on Postgres,
+# case-insensitive B-trees for prefix LIKE on SQLite
+event.listen(Base.metadata, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+for _column in ("first_name", "second_name", "email"):
+    Index(f"ix_users_{_column}_trgm", getattr(User, _column), postgresql_using="gin",
+          postgresql_ops={_column: "gin_trgm_ops"}).ddl_if(dialect="postgresql")
+    Index(f"ix_users_{_column}_nocase", getattr(User, _column).collate("NOCASE")).ddl_if(dialect="sqlite")
 
 
 class TaskAssigned(Base):
     __tablename__ = "task_assigned"
     task_id = mapped_column(ForeignKey("tasks.id", ondelete="CASCADE"), primary_key=True)
-    user_id = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    user_id = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, index=True)
 
 
 class Project(Base):
@@ -64,6 +76,18 @@ class Task(Base):
     name: Mapped[str]
     comments: Mapped[list["Comment"]] = relationship(back_populates="task")
     status: Mapped[TaskStatus]
+    # time_end the deadline reminder was last sent for
+    reminded_for: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+# Calendar overlap lookups: a range GiST index on Postgres, a plain B-tree on SQLite
+Index("ix_tasks_time_range", func.tstzrange(Task.time_start, Task.time_end, "[]"),
+      postgresql_using="gist").ddl_if(dialect="postgresql")
+Index("ix_tasks_time_start_time_end", Task.time_start, Task.time_end).ddl_if(dialect="sqlite")
+Index("ix_tasks_time_end", Task.time_end)
+# Overdue counts per project only touch open tasks
+Index("ix_tasks_open_deadline", Task.project_id, Task.time_end,
+      postgresql_where=Task.status != TaskStatus.completed, sqlite_where=Task.status != TaskStatus.completed)
 
 
 class ProjectMembers(Base):
@@ -80,8 +104,15 @@ class MessageType(enum.Enum):
 
 class Message(Base):
     __tablename__ = "messages"
-    id: Mapped[intpk]
-    timestamp: Mapped[datetime.datetime] = mapped_column(default=text("TIMEZONE('utc', now())"))
+    # Partitioned by month on timestamp, so the partition key has to be part of the primary key
+    __table_args__ = (
+        Index("ix_messages_chat_id_timestamp", "chat_id", "timestamp"),
+        Index("ix_messages_user_id", "user_id"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+    id: Mapped[int] = mapped_column(autoincrement=True, primary_key=True)
+    timestamp: Mapped[datetime.datetime] = mapped_column(primary_key=True,
+                                                         default=text("TIMEZONE('utc', now())"))
     type: Mapped[MessageType]
     content: Mapped[str] = mapped_column(nullable=True)
     file_path: Mapped[str] = mapped_column(nullable=True)
@@ -89,7 +120,8 @@ class Message(Base):
     sender: Mapped["User"] = relationship(back_populates="messages")
     chat_id: Mapped[int] = mapped_column(ForeignKey("chats.id", ondelete="CASCADE"))
     chat: Mapped["Chat"] = relationship(back_populates="messages")
-    reactions: Mapped[list["Reaction"]] = relationship(back_populates="message")
+    reactions: Mapped[list["Reaction"]] = relationship(back_populates="message",
+                                                       primaryjoin="Message.id == foreign(Reaction.message_id)")
     read_id: Mapped[list[int]] = mapped_column(JSON, default=[])
 
 
@@ -111,11 +143,15 @@ class Chat(Base):
 class ChatMember(Base):
     __tablename__ = "chat_members"
     chat_id = mapped_column(ForeignKey("chats.id", ondelete="CASCADE"), primary_key=True)
-    user_id = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    user_id = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, index=True)
 
 
 class Comment(Base):
     __tablename__ = "comments"
+    __table_args__ = (
+        Index("ix_comments_task_id_timestamp", "task_id", "timestamp"),
+        Index("ix_comments_parent_comment_id", "parent_comment_id"),
+    )
     id: Mapped[intpk]
     content: Mapped[str]
     timestamp: Mapped[datetime.datetime] = mapped_column(default=text("TIMEZONE('utc', now())"))
@@ -123,17 +159,66 @@ class Comment(Base):
     sender: Mapped["User"] = relationship(back_populates="comments")
     task_id: Mapped[int] = mapped_column(ForeignKey("tasks.id", ondelete="CASCADE"))
     task: Mapped["Task"] = relationship(back_populates="comments")
-    #parent_comment_id: Mapped[int] = mapped_column(ForeignKey("comments.id", ondelete="CASCADE"), nullable=True)
-    #replies: Mapped[list["Comment"]] = relationship("Comment", back_populates="parent_comment")
-    #parent_comment: Mapped["Comment"] = relationship("Comment", back_populates="replies", remote_side="Comment.id")
+    parent_comment_id: Mapped[Optional[int]] = mapped_column(ForeignKey("comments.id", ondelete="CASCADE"),
+                                                             nullable=True)
+    replies: Mapped[list["Comment"]] = relationship("Comment", back_populates="parent_comment")
+    parent_comment: Mapped["Comment"] = relationship("Comment", back_populates="replies", remote_side="Comment.id")
 
 
 class Reaction(Base):
     __tablename__ = "reactions"
     id: Mapped[intpk]
     content: Mapped[int]
-    message_id: Mapped[int] = mapped_column(ForeignKey("messages.id"), onupdate="CASCADE")
-    message: Mapped["Message"] = relationship(back_populates="reactions")
+    # No FK: messages is partitioned and old partitions are detached by the archival job
+    message_id: Mapped[int] = mapped_column(index=True)
+    message: Mapped["Message"] = relationship(back_populates="reactions",
+                                              primaryjoin="Message.id == foreign(Reaction.message_id)")
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
     sender: Mapped["User"] = relationship(back_populates="reactions")
 
+
+class MessageArchive(Base):
+    __tablename__ = "message_archives"
+    month: Mapped[datetime.date] = mapped_column(primary_key=True)
+    path: Mapped[str]
+    messages: Mapped[int]
+    archived_at: Mapped[datetime.datetime] = mapped_column(default=text("TIMEZONE('utc', now())"))
+
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+    id: Mapped[str] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
+    chat_id: Mapped[int] = mapped_column(ForeignKey("chats.id", ondelete="CASCADE"))
+    filename: Mapped[str]
+    path: Mapped[str]
+    size: Mapped[int] = mapped_column(BigInteger)
+    offset: Mapped[int] = mapped_column(BigInteger, default=0)
+    updated_at: Mapped[datetime.datetime] = mapped_column(default=text("TIMEZONE('utc', now())"), index=True)
+
+
+class SchedulerLease(Base):
+    __tablename__ = "scheduler_leases"
+    name: Mapped[str] = mapped_column(primary_key=True)
+    owner: Mapped[str]
+    expires_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True))
+
+
+class ProjectStats(Base):
+    """Task counts per status, kept current by the task mutations in the same transaction."""
+    __tablename__ = "project_stats"
+    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"), primary_key=True)
+    todo: Mapped[int] = mapped_column(default=0)
+    inprogress: Mapped[int] = mapped_column(default=0)
+    completed: Mapped[int] = mapped_column(default=0)
+    updated_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
+class ProjectStatsDaily(Base):
+    __tablename__ = "project_stats_daily"
+    project_id: Mapped[int] = mapped_column(ForeignKey("projects.id", ondelete="CASCADE"), primary_key=True)
+    day: Mapped[datetime.date] = mapped_column(Date, primary_key=True)
+    todo: Mapped[int]
+    inprogress: Mapped[int]
+    completed: Mapped[int]
+    overdue: Mapped[int]
@@ -0,0 +1,251 @@
+import asyncio
+import datetime
+import gzip
+import heapq
+import json
+import logging
+from pathlib import Path
+from typing import Iterator, Optional
+
+from sqlalchemy import select, delete, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.orm import selectinload
+
+from database.config import config
+from database.database_init import engine, session_factory
+from database.unit_of_work import scoped_session
+from database.models import Message, MessageArchive, Reaction
+from scheduler.lease import acquire_lease, worker_id
+
+logger = logging.getLogger("uvicorn.error")
+
+ARCHIVE_DIR = Path(config.ARCHIVE_DIR)
+LEASE_NAME = "message_partitions"
+
+
+def month_start(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+
+def add_months(day: datetime.date, months: int) -> datetime.date:
+    month = day.month - 1 + months
+    return datetime.date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month: datetime.date) -> str:
+    return f"messages_{month:%Y_%m}"
+
+
+async def _create_partition(conn: AsyncConnection, month: datetime.date):
+    """
+    Create one monthly partition. Postgres refuses to add a partition whose range already has
+    rows in the default partition, so those are moved over while the default is detached.
+    """
+    bounds = f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+    in_range = f"\"timestamp\" >= '{month}' AND \"timestamp\" < '{add_months(month, 1)}'"
+    stray = (await conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM messages_default WHERE {in_range})"))).scalar()
+    if not stray:
+        await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF messages {bounds}"))
+        return
+    columns = ", ".join(f'"{column.name}"' for column in Message.__table__.columns)
+    await conn.execute(text("ALTER TABLE messages DETACH PARTITION messages_default"))
+    await conn.execute(text(f"CREATE TABLE {partition_name(month)} PARTITION OF messages {bounds}"))
+    await conn.execute(text(f"INSERT INTO {partition_name(month)} ({columns}) "
+                            f"SELECT {columns} FROM messages_default WHERE {in_range}"))
+    await conn.execute(text(f"DELETE FROM messages_default WHERE {in_range}"))
+    await conn.execute(text("ALTER TABLE messages ATTACH PARTITION messages_default DEFAULT"))
+
+
+async def ensure_message_partitions(conn: AsyncConnection, first: Optional[datetime.date] = None,
+                                    ahead: int = config.MESSAGE_PARTITIONS_AHEAD):
+    """Create monthly partitions from `first` up to `ahead` months past the current one."""
+    if conn.dialect.name != "postgresql":
+        return
+    current = month_start(datetime.datetime.utcnow().date())
+    month = month_start(first) if first else current
+    await conn.execute(text("CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT"))
+    while month <= add_months(current, ahead):
+        exists = (await conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"),
+                                     {"name": partition_name(month)})).scalar()
+        if not exists:
+            await _create_partition(conn, month)
+        month = add_months(month, 1)
+
+
+async def partition_loop():
+    """Top up the monthly partitions every PARTITION_CHECK_HOURS on whichever worker holds the lease."""
+    owner = worker_id()
+    interval = config.PARTITION_CHECK_HOURS * 3600
+    while True:
+        try:
+            if await acquire_lease(LEASE_NAME, owner, interval * 0.9):
+                async with engine.begin() as conn:
+                    await ensure_message_partitions(conn)
+        except Exception:
+            logger.exception("Message partition maintenance failed")
+        await asyncio.sleep(interval)
+
+
+def _message_row(message: Message, reactions: list[Reaction]) -> dict:
+    return {
+        "id": message.id,
+        "chat_id": message.chat_id,
+        "user_id": message.user_id,
+        "timestamp": message.timestamp.isoformat(),
+        "type": message.type.value,
+        "content": message.content,
+        "file_path": message.file_path,
+        "read_id": message.read_id,
+        "reactions": [
+            {
+                "content": reaction.content,
+                "sender": {
+                    "id": reaction.sender.id,
+                    "email": reaction.sender.email,
+                    "first_name": reaction.sender.first_name,
+                    "second_name": reaction.sender.second_name,
+                    "photo": reaction.sender.photo,
+                },
+            }
+            for reaction in reactions
+        ],
+    }
+
+
+async def archive_month(month: datetime.date) -> int:
+    """
+    Write one monthly partition to a gzipped NDJSON file, then detach and drop it.
+    Rows are ordered by (chat_id, timestamp) so readers can stop early.
+    """
+    month = month_start(month)
+    start, end = datetime.datetime.combine(month, datetime.time()), \
+        datetime.datetime.combine(add_months(month, 1), datetime.time())
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    path = ARCHIVE_DIR / f"{partition_name(month)}.ndjson.gz"
+    count = 0
+    async with session_factory() as session:
+        # Eager loaders can't run under yield_per, so each chunk's reactions come from one extra query
+        query = (select(Message)
+                 .where(Message.timestamp >= start, Message.timestamp < end)
+                 .order_by(Message.chat_id, Message.timestamp, Message.id)
+                 .execution_options(yield_per=1000))
+        result = await session.stream_scalars(query)
+        try:
+            with gzip.open(path, "wt", encoding="utf-8") as archive:
+                async for messages in result.partitions():
+                    reactions: dict[int, list[Reaction]] = {}
+                    for reaction in (await session.execute(
+                            select(Reaction).options(selectinload(Reaction.sender))
+                            .where(Reaction.message_id.in_([message.id for message in messages])))).scalars():
+                        reactions.setdefault(reaction.message_id, []).append(reaction)
+                    for message in messages:
+                        archive.write(json.dumps(_message_row(message, reactions.get(message.id, [])),
+                                                 ensure_ascii=False) + "\n")
+                        count += 1
+        finally:
+            await result.close()
+        # The cursor keeps the partition in use until its transaction ends
+        await session.commit()
+        session.add(MessageArchive(month=month, path=str(path), messages=count))
+        await session.execute(delete(Reaction).where(
+            Reaction.message_id.in_(select(Message.id).where(Message.timestamp >= start, Message.timestamp < end))
+        ))
+        await session.execute(text(f"ALTER TABLE messages DETACH PARTITION {partition_name(month)}"))
+        await session.execute(text(f"DROP TABLE {partition_name(month)}"))
+        await session.commit()
+    return count
+
+
+async def archive_old_partitions(retention_months: int = config.MESSAGE_RETENTION_MONTHS):
+    cutoff = add_months(month_start(datetime.datetime.utcnow().date()), -retention_months)
+    async with engine.connect() as conn:
+        rows = await conn.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = 'messages' AND child.relname != 'messages_default'"
+        ))
+        names = rows.scalars().all()
+    archived = {}
+    for name in sorted(names):
+        month = datetime.datetime.strptime(name, "messages_%Y_%m").date()
+        if month < cutoff:
+            archived[month] = await archive_month(month)
+    async with engine.begin() as conn:
+        await ensure_message_partitions(conn)
+    return archived
+
+
+def iter_archive(path: str, chat_id: Optional[int] = None, user_id: Optional[int] = None) -> Iterator[dict]:
+    """Rows of one archive file, optionally of one chat and/or sender, in (chat_id, timestamp, id) order."""
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        for line in archive:
+            row = json.loads(line)
+            if chat_id is not None:
+                if row["chat_id"] < chat_id:
+                    continue
+                if row["chat_id"] > chat_id:
+                    break
+            if user_id is None or row["user_id"] == user_id:
+                yield row
+
+
+def _iter_run(path: str, offset: int, user_id: Optional[int]) -> Iterator[dict]:
+    """Rows of the chat run starting at uncompressed byte `offset`, optionally of one sender."""
+    with gzip.open(path, "rb") as archive:
+        archive.seek(offset)
+        chat_id = None
+        for line in archive:
+            row = json.loads(line)
+            if chat_id is None:
+                chat_id = row["chat_id"]
+            elif row["chat_id"] != chat_id:
+                break
+            if user_id is None or row["user_id"] == user_id:
+                yield row
+
+
+def iter_archive_by_time(path: str, user_id: Optional[int] = None) -> Iterator[dict]:
+    """
+    Rows of one archive file, optionally of one sender, in (timestamp, id) order. One pass
+    finds the chat runs holding the sender's rows, then one reader per run is merged, so
+    memory grows with the number of chats rather than messages.
+    """
+    offsets = []
+    with gzip.open(path, "rb") as archive:
+        offset, chat_id, run = 0, None, None
+        for line in archive:
+            row = json.loads(line)
+            if row["chat_id"] != chat_id:
+                chat_id, run = row["chat_id"], offset
+            if run is not None and (user_id is None or row["user_id"] == user_id):
+                offsets.append(run)
+                run = None
+            offset += len(line)
+    return heapq.merge(*(_iter_run(path, start, user_id) for start in offsets),
+                       key=lambda row: (row["timestamp"], row["id"]))
+
+
+def _read_archive(path: str, chat_id: int, before: Optional[datetime.datetime], limit: int) -> list[dict]:
+    rows = []
+    for row in iter_archive(path, chat_id):
+        row["timestamp"] = datetime.datetime.fromisoformat(row["timestamp"])
+        if before is None or row["timestamp"] < before:
+            rows.append(row)
+    return rows[-limit:]
+
+
+async def read_archived_messages(chat_id: int, before: Optional[datetime.datetime], limit: int) -> list[dict]:
+    """Newest-first archived messages of a chat older than `before`, loading months on demand."""
+    async with scoped_session(read=True) as session:
+        query = select(MessageArchive).order_by(MessageArchive.month.desc())
+        if before is not None:
+            query = query.where(MessageArchive.month <= before.date())
+        archives = (await session.execute(query)).scalars().all()
+    messages = []
+    for archive in archives:
+        rows = await asyncio.to_thread(_read_archive, archive.path, chat_id, before, limit - len(messages))
+        messages.extend(reversed(rows))
+        if len(messages) >= limit:
+            break
+    return messages
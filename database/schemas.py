@@ -1,7 +1,7 @@
 import datetime
 
 from fastapi import UploadFile, File, Form
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, field_validator, model_validator
 from typing import List, Optional, Annotated
 
 
@@ -53,6 +53,15 @@ class ProjectOut(BaseModel):
         from_attributes = True
 
 
+def time_range_valid(time_start: Optional[datetime.datetime], time_end: Optional[datetime.datetime]) -> bool:
+    """A task may not end before it starts (tstzrange rejects it); naive times count as UTC."""
+    if time_start is None or time_end is None:
+        return True
+    utc = datetime.timezone.utc
+    return (time_end if time_end.tzinfo else time_end.replace(tzinfo=utc)) >= \
+        (time_start if time_start.tzinfo else time_start.replace(tzinfo=utc))
+
+
 class TaskCreate(BaseModel):
     assigned: List[int]
     time_start: datetime.datetime
@@ -60,6 +69,12 @@ class TaskCreate(BaseModel):
     description: str
     name: str
 
+    @model_validator(mode='after')
+    def check_time_range(self):
+        if not time_range_valid(self.time_start, self.time_end):
+            raise ValueError("time_end must not be before time_start")
+        return self
+
 
 class TaskUpdate(BaseModel):
     assigned: Optional[List[int]] = None
@@ -69,6 +84,12 @@ class TaskUpdate(BaseModel):
     name: Optional[str] = None
     status: Optional[str] = None
 
+    @model_validator(mode='after')
+    def check_time_range(self):
+        if not time_range_valid(self.time_start, self.time_end):
+            raise ValueError("time_end must not be before time_start")
+        return self
+
 
 class TaskWithoutProject(BaseModel):
     assigned: List[UserSearchResult]
@@ -81,6 +102,7 @@ class TaskWithoutProject(BaseModel):
 class CommentsCreate(BaseModel):
     content: str
     task_id: int
+    parent_comment_id: Optional[int] = None
 
 
 class UserEmail(BaseModel):
@@ -103,16 +125,48 @@ class CommentsOut(CommentsCreate):
         return v.astimezone(datetime.timezone.utc)
 
 
+class CommentThreadOut(CommentsOut):
+    depth: int
+    replies: List["CommentThreadOut"] = []
+    has_more_replies: bool = False
+
+
 class TaskOut(TaskWithoutProject):
     assigned: List[UserSearchResult]
     id: int
-    comments: list[CommentsOut]
     status: str
 
     class Config:
         from_attributes = True
 
 
+class CalendarTaskOut(TaskOut):
+    project_id: int
+
+    class Config:
+        from_attributes = True
+
+
+class ProjectStatsOut(BaseModel):
+    project_id: int
+    todo: int
+    inprogress: int
+    completed: int
+    total: int
+    overdue: int
+
+
+class ProjectStatsDayOut(BaseModel):
+    day: datetime.date
+    todo: int
+    inprogress: int
+    completed: int
+    overdue: int
+
+    class Config:
+        from_attributes = True
+
+
 class ChatBase(BaseModel):
     name: Optional[str]
     type: str
@@ -132,6 +186,22 @@ class ChatOut(ChatBase):
         from_attributes = True
 
 
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+
+
+class UploadSessionOut(BaseModel):
+    id: str
+    chat_id: int
+    filename: str
+    size: int
+    offset: int
+
+    class Config:
+        from_attributes = True
+
+
 class ChatUpdate(BaseModel):
     photo: Optional[str]
 
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select, update, delete, func, literal, exists
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Project, Task, TaskStatus, ProjectStats, ProjectStatsDaily
+from database.unit_of_work import scoped_session, commit
+from scheduler.lease import acquire_lease, worker_id
+
+logger = logging.getLogger("uvicorn.error")
+
+STATUSES = [status.name for status in TaskStatus]
+LEASE_NAME = "stats_snapshot"
+# Held past midnight by the worker that took the snapshot, long enough to shut out the others
+LEASE_TTL = 3600
+
+
+def _overdue(now: datetime):
+    """Open tasks past their deadline. Served by the partial index ix_tasks_open_deadline."""
+    return Task.status != TaskStatus.completed, Task.time_end < now
+
+
+async def _counts(session: AsyncSession, project_id: Optional[int] = None) -> dict[int, dict[str, int]]:
+    query = select(Task.project_id, Task.status, func.count()).group_by(Task.project_id, Task.status)
+    if project_id is not None:
+        query = query.where(Task.project_id == project_id)
+    counts: dict[int, dict[str, int]] = {}
+    for pid, status, count in await session.execute(query):
+        counts.setdefault(pid, dict.fromkeys(STATUSES, 0))[status.name] = count
+    return counts
+
+
+async def recompute_project(session: AsyncSession, project_id: int):
+    counts = (await _counts(session, project_id)).get(project_id, dict.fromkeys(STATUSES, 0))
+    stats = await session.get(ProjectStats, project_id)
+    if stats is None:
+        stats = ProjectStats(project_id=project_id)
+        session.add(stats)
+    for name, count in counts.items():
+        setattr(stats, name, count)
+
+
+async def backfill_stats(session: AsyncSession, project_id: Optional[int] = None) -> int:
+    """
+    Create the counters row, from the tasks, of projects that have none, such as those
+    created before project_stats existed. Returns how many rows were created.
+    """
+    counts = (select(Project.id, *[func.count(Task.id).filter(Task.status == status) for status in TaskStatus])
+              .outerjoin(Task, Task.project_id == Project.id)
+              .where(~exists().where(ProjectStats.project_id == Project.id))
+              .group_by(Project.id))
+    if project_id is not None:
+        counts = counts.where(Project.id == project_id)
+    result = await session.execute(
+        pg_insert(ProjectStats).from_select(["project_id", *STATUSES], counts).on_conflict_do_nothing()
+    )
+    return result.rowcount
+
+
+async def adjust_stats(session: AsyncSession, project_id: int, deltas: dict[TaskStatus, int]):
+    """Apply status count deltas in the caller's transaction. A missing row is rebuilt from the tasks."""
+    values = {status.name: getattr(ProjectStats, status.name) + delta for status, delta in deltas.items() if delta}
+    if not values:
+        return
+    result = await session.execute(
+        update(ProjectStats).where(ProjectStats.project_id == project_id)
+        .values(**values, updated_at=func.now())
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        await recompute_project(session, project_id)
+
+
+async def get_project_stats(project_id: int, session: Optional[AsyncSession] = None) -> dict:
+    now = datetime.now(timezone.utc)
+    async with scoped_session(session, read=True) as session:
+        stats = await session.get(ProjectStats, project_id)
+        if stats is None:
+            async with scoped_session() as primary:
+                await backfill_stats(primary, project_id)
+                await commit(primary)
+            counts = (await _counts(session, project_id)).get(project_id, dict.fromkeys(STATUSES, 0))
+        else:
+            counts = {name: getattr(stats, name) for name in STATUSES}
+        overdue = (await session.execute(
+            select(func.count()).select_from(Task).where(Task.project_id == project_id, *_overdue(now))
+        )).scalar()
+    return {"project_id": project_id, **counts, "total": sum(counts.values()), "overdue": overdue}
+
+
+async def get_burndown(project_id: int, days: int, session: Optional[AsyncSession] = None) -> list[ProjectStatsDaily]:
+    since = datetime.now(timezone.utc).date() - timedelta(days=days)
+    query = (select(ProjectStatsDaily)
+             .where(ProjectStatsDaily.project_id == project_id, ProjectStatsDaily.day > since)
+             .order_by(ProjectStatsDaily.day))
+    async with scoped_session(session, read=True) as session:
+        return list((await session.execute(query)).scalars().all())
+
+
+async def snapshot_stats(day: date):
+    """Copy every project's counters into the burndown history for the given day, replacing a previous run."""
+    now = datetime.now(timezone.utc)
+    overdue = (select(Task.project_id, func.count().label("overdue"))
+               .where(*_overdue(now)).group_by(Task.project_id).subquery())
+    rows = (select(ProjectStats.project_id, literal(day, ProjectStatsDaily.day.type), ProjectStats.todo,
+                   ProjectStats.inprogress, ProjectStats.completed, func.coalesce(overdue.c.overdue, 0))
+            .outerjoin(overdue, overdue.c.project_id == ProjectStats.project_id))
+    async with scoped_session() as session:
+        await backfill_stats(session)
+        await session.execute(delete(ProjectStatsDaily).where(ProjectStatsDaily.day == day))
+        await session.execute(ProjectStatsDaily.__table__.insert().from_select(
+            ["project_id", "day", "todo", "inprogress", "completed", "overdue"], rows))
+        await commit(session)
+
+
+async def snapshot_daily():
+    """
+    Snapshot the counters at each UTC midnight as the closing state of the day that ended,
+    on whichever worker takes the lease.
+    """
+    owner = worker_id()
+    while True:
+        now = datetime.now(timezone.utc)
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), timezone.utc)
+        await asyncio.sleep((midnight - now).total_seconds())
+        try:
+            if await acquire_lease(LEASE_NAME, owner, LEASE_TTL):
+                await snapshot_stats(midnight.date() - timedelta(days=1))
+        except Exception:
+            logger.exception("Project stats snapshot failed")
+
+
+async def repair_stats() -> int:
+    """Recompute every project's counters from the tasks table. Returns how many rows were off."""
+    async with scoped_session() as session:
+        counts = await _counts(session)
+        stored = {row.project_id: {name: getattr(row, name) for name in STATUSES}
+                  for row in (await session.execute(select(ProjectStats))).scalars()}
+        project_ids = (await session.execute(select(Project.id))).scalars().all()
+        drifted = 0
+        for project_id in project_ids:
+            expected = counts.get(project_id, dict.fromkeys(STATUSES, 0))
+            if stored.get(project_id) == expected:
+                continue
+            drifted += 1
+            await recompute_project(session, project_id)
+        await commit(session)
+    return drifted
@@ -0,0 +1,155 @@
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.database_init import session_factory, read_session, replica_session_factory, current_unit
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class UnitOfWork:
+    """
+    One session, one connection checkout and one transaction for a request or socket event.
+    The session is opened on first use, after authentication has set current_user_id, so a
+    read-only unit goes to the replica or, right after the user's own write, to the primary.
+    """
+
+    def __init__(self, read_only: bool = False):
+        self.read_only = read_only
+        self.session: Optional[AsyncSession] = None
+
+    def get(self, read: bool = False) -> Optional[AsyncSession]:
+        """
+        The unit's session, or None when the caller needs the primary but the unit reads
+        from the replica. A read-only unit is not bound by a primary-only caller (such as
+        authentication), which would pin the rest of the request to the primary.
+        """
+        if self.session is None:
+            if self.read_only and not read and replica_session_factory is not None:
+                return None
+            self.session = read_session() if self.read_only else session_factory()
+            self.session.info["unit_of_work"] = True
+        if self.session.info.get("replica") and not read:
+            return None
+        return self.session
+
+    async def commit(self):
+        if self.session is not None:
+            await self.session.commit()
+
+    async def rollback(self):
+        if self.session is not None:
+            await self.session.rollback()
+
+    async def release(self):
+        """Commit and return the connection to the pool; a later call opens a new session."""
+        if self.session is not None:
+            session, self.session = self.session, None
+            try:
+                await session.commit()
+            finally:
+                await session.close()
+
+
+@asynccontextmanager
+async def scoped_session(session: Optional[AsyncSession] = None, read: bool = False) -> AsyncIterator[AsyncSession]:
+    """
+    Session for an AsyncORM call: the one passed in, else the current unit of work,
+    else a short-lived one of its own.
+    """
+    if session is None:
+        unit = current_unit.get()
+        if unit is not None:
+            session = unit.get(read)
+    if session is not None:
+        yield session
+        return
+    async with (read_session() if read else session_factory()) as own:
+        yield own
+
+
+async def commit(session: AsyncSession):
+    """Commit a session owned by the caller, or only flush when it belongs to a unit of work."""
+    if session.info.get("unit_of_work"):
+        await session.flush()
+    else:
+        await session.commit()
+
+
+async def commit_current():
+    """Commit the current unit of work early, e.g. before announcing its results over a socket."""
+    unit = current_unit.get()
+    if unit is not None:
+        await unit.commit()
+
+
+async def release_current():
+    """Commit the current unit of work and give its connection back, e.g. before a long body upload."""
+    unit = current_unit.get()
+    if unit is not None:
+        await unit.release()
+
+
+@asynccontextmanager
+async def unit_of_work(read_only: bool = False) -> AsyncIterator[AsyncSession]:
+    """One session, one connection checkout and one transaction for the enclosed block."""
+    unit = UnitOfWork(read_only)
+    token = current_unit.set(unit)
+    try:
+        yield unit.get(read=read_only)
+        await unit.commit()
+    finally:
+        current_unit.reset(token)
+        if unit.session is not None:
+            await unit.session.close()
+
+
+class UnitOfWorkMiddleware:
+    """
+    Runs each HTTP request in a unit of work, read-only for GET/HEAD. The transaction
+    is committed just before the response starts (rolled back on 4xx/5xx), so the
+    client never sees a success for work that failed to commit.
+    """
+
+    COMMIT_FAILED = b'{"detail":"Could not save changes"}'
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        unit = UnitOfWork(read_only=scope["method"] in ("GET", "HEAD"))
+        token = current_unit.set(unit)
+        failed = False
+
+        async def send_wrapper(message):
+            nonlocal failed
+            if message["type"] == "http.response.start":
+                try:
+                    if message["status"] < 400:
+                        await unit.commit()
+                    else:
+                        await unit.rollback()
+                except Exception:
+                    logger.exception("Unit of work commit failed")
+                    await unit.rollback()
+                    failed = True
+                    message = {"type": "http.response.start", "status": 500,
+                               "headers": [(b"content-type", b"application/json"),
+                                           (b"content-length", str(len(self.COMMIT_FAILED)).encode())]}
+            elif failed and message["type"] == "http.response.body":
+                if message.get("more_body"):
+                    return
+                message = {"type": "http.response.body", "body": self.COMMIT_FAILED}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_unit.reset(token)
+            if unit.session is not None:
+                await unit.session.close()
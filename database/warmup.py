@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select
+
+from database import schemas
+from database.config import config
+from database.crud import AsyncORM
+from database.database_init import replica_engine
+from database.models import User, ChatMember
+from database.unit_of_work import unit_of_work
+
+logger = logging.getLogger("uvicorn.error")
+
+
+async def _sample() -> tuple[Optional[int], Optional[str], Optional[int]]:
+    """A real user (and one of their chats), so every selectinload stage actually runs."""
+    async with unit_of_work() as session:
+        row = (await session.execute(select(User.id, User.email, ChatMember.chat_id)
+                                     .outerjoin(ChatMember, ChatMember.user_id == User.id)
+                                     .order_by(ChatMember.chat_id.is_(None)).limit(1))).first()
+    return tuple(row) if row else (None, None, None)
+
+
+async def _hot_queries(user_id: Optional[int], email: Optional[str], chat_id: Optional[int]) -> dict:
+    """The statements behind the busiest routes and socket events, with the parameters they use."""
+    results = {"user": await AsyncORM.get_user_by_id(user_id or 0)}
+    await AsyncORM.get_user_by_email(email or "")
+    if user_id is None:
+        return results
+    now = datetime.now(timezone.utc)
+    results["chats"] = await AsyncORM.get_all_chats(user_id)
+    results["projects"] = await AsyncORM.get_users_projects(user_id)
+    await AsyncORM.get_user_chat_ids(user_id)
+    await AsyncORM.get_calendar(user_id, now, now + timedelta(days=7))
+    if chat_id is not None:
+        await AsyncORM.get_single_chat(chat_id)
+        results["history"] = await AsyncORM.get_chat_history(chat_id, user_id, None, 1)
+    return results
+
+
+async def _warm_connection(barrier: asyncio.Barrier, read_only: bool, sample: tuple) -> dict:
+    """
+    Check out a connection, wait until every other warm-up task holds its own, then run the
+    hot statements on it: asyncpg prepares statements per connection, so each one needs them.
+    """
+    try:
+        async with unit_of_work(read_only=read_only) as session:
+            await session.execute(select(1))
+            await barrier.wait()
+            return await _hot_queries(*sample)
+    except BaseException:
+        await barrier.abort()
+        raise
+
+
+def _warm_schemas(results: dict):
+    """First validation from ORM objects builds the attribute-based validators and serializers."""
+    if results.get("user") is not None:
+        schemas.UserSearchResult.model_validate(results["user"]).model_dump_json()
+    if results.get("chats") is not None:
+        schemas.UserChats.model_validate(results["chats"]).model_dump_json()
+    if results.get("projects") is not None:
+        schemas.UserProjects.model_validate(results["projects"]).model_dump_json()
+    for message in results.get("history", []):
+        schemas.MessageOut.model_validate(message).model_dump_json()
+
+
+async def warm_up() -> float:
+    """
+    Open DB_POOL_PREFILL connections on the primary (and replica) pool, run the hot statements
+    on each of them to fill the compiled and prepared statement caches, and validate the
+    results through the response schemas. Returns the seconds spent.
+    """
+    start = time.perf_counter()
+    sample = await _sample()
+    size = min(config.DB_POOL_PREFILL or config.DB_POOL_SIZE, config.DB_POOL_SIZE)
+    results = {}
+    for read_only in [False] + ([True] if replica_engine is not None else []):
+        barrier = asyncio.Barrier(size)
+        results = (await asyncio.gather(*(_warm_connection(barrier, read_only, sample) for _ in range(size))))[0]
+    _warm_schemas(results)
+    elapsed = time.perf_counter() - start
+    logger.info("Warm-up: %d connection(s) per pool in %.3fs", size, elapsed)
+    return elapsed
@@ -0,0 +1,26 @@
+import argparse
+import asyncio
+import sys
+
+from database.export import EXPORT_FORMATS, export_messages
+
+
+async def export(args):
+    stream, _, _ = EXPORT_FORMATS[args.format]
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        async for chunk in stream(export_messages(chat_id=args.chat, user_id=args.user)):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export chat history")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--chat", type=int)
+    target.add_argument("--user", type=int)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--output")
+    asyncio.run(export(parser.parse_args()))
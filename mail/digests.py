@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update, func, cast, not_
+from sqlalchemy.dialects.postgresql import JSONB
+
+from database.database_init import session_factory
+from database.models import User, Chat, ChatMember, Message
+from mail.mail_config import conf
+from mail.mail_config_reader import mail_config
+from mail.sender import SMTPPool
+from scheduler.lease import acquire_lease, worker_id
+
+logger = logging.getLogger("uvicorn.error")
+
+LEASE_NAME = "unread_digests"
+
+
+def unread_query(cutoff: datetime):
+    """
+    Unread message counts per (offline user, chat) since each user's last digest, for all
+    users in one statement. Ordered by user so a digest is complete once the user id changes.
+    """
+    since = func.coalesce(User.last_digest_at, cutoff - timedelta(hours=mail_config.DIGEST_LOOKBACK_HOURS))
+    unread = func.count(Message.id).label("unread")
+    return (select(User.id, User.email, Chat.id.label("chat_id"), Chat.name, unread)
+            .join(ChatMember, ChatMember.user_id == User.id)
+            .join(Chat, Chat.id == ChatMember.chat_id)
+            .join(Message, Message.chat_id == ChatMember.chat_id)
+            .where(User.is_online.is_(False), User.is_active.is_(True), User.email.is_not(None),
+                   Message.timestamp > since, Message.timestamp <= cutoff, Message.user_id != User.id,
+                   not_(cast(Message.read_id, JSONB).contains(func.to_jsonb(User.id))))
+            .group_by(User.id, User.email, Chat.id, Chat.name)
+            .order_by(User.id, unread.desc())
+            .execution_options(yield_per=mail_config.DIGEST_BATCH))
+
+
+def render(digest: dict) -> tuple[str, str]:
+    lines = [f"{chat['unread']} in {chat['name'] or 'a direct chat'}" for chat in digest["chats"]]
+    hidden = digest["chat_count"] - len(digest["chats"])
+    if hidden > 0:
+        lines.append(f"and more in {hidden} other chat(s)")
+    subject = f"You have {digest['unread']} unread message(s)"
+    return subject, "Unread messages:\n" + "\n".join(lines)
+
+
+async def _deliver(pool: SMTPPool, batch: list[dict], cutoff: datetime) -> int:
+    """Send a batch of digests over the pool and move last_digest_at for the ones that went out."""
+    results = await asyncio.gather(*(pool.send(digest["email"], *render(digest)) for digest in batch),
+                                   return_exceptions=True)
+    sent = [digest["user_id"] for digest, result in zip(batch, results) if not isinstance(result, Exception)]
+    for digest, result in zip(batch, results):
+        if isinstance(result, Exception):
+            logger.warning("Digest to user %s failed: %s", digest["user_id"], result)
+    if sent:
+        async with session_factory() as session:
+            await session.execute(update(User).where(User.id.in_(sent)).values(last_digest_at=cutoff))
+            await session.commit()
+    return len(sent)
+
+
+async def send_digests() -> int:
+    """
+    One digest run. Rows are streamed through a server-side cursor and at most
+    DIGEST_BATCH digests are held at a time, so memory does not grow with the user count.
+    Returns the number of digests sent.
+    """
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None)
+    pool = SMTPPool(conf, mail_config.SMTP_POOL_SIZE)
+    sent = 0
+    batch: list[dict] = []
+    digest = None
+    try:
+        async with session_factory() as reader:
+            result = await reader.stream(unread_query(cutoff))
+            async for row in result:
+                if digest is None or digest["user_id"] != row.id:
+                    if digest is not None:
+                        batch.append(digest)
+                    if len(batch) >= mail_config.DIGEST_BATCH:
+                        sent += await _deliver(pool, batch, cutoff)
+                        batch = []
+                    digest = {"user_id": row.id, "email": row.email, "chats": [], "chat_count": 0, "unread": 0}
+                digest["chat_count"] += 1
+                digest["unread"] += row.unread
+                if len(digest["chats"]) < mail_config.DIGEST_MAX_CHATS:
+                    digest["chats"].append({"name": row.name, "unread": row.unread})
+        if digest is not None:
+            batch.append(digest)
+        if batch:
+            sent += await _deliver(pool, batch, cutoff)
+    finally:
+        await pool.close()
+    return sent
+
+
+async def digest_loop():
+    """Run send_digests every DIGEST_INTERVAL_MINUTES on whichever worker holds the lease."""
+    owner = worker_id()
+    interval = mail_config.DIGEST_INTERVAL_MINUTES * 60
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await acquire_lease(LEASE_NAME, owner, interval * 0.9):
+                started = datetime.now(timezone.utc)
+                sent = await send_digests()
+                logger.info("Sent %d digest(s) in %s", sent, datetime.now(timezone.utc) - started)
+        except Exception:
+            logger.exception("Digest run failed")
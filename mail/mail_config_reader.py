@@ -13,6 +13,12 @@ class Settings(BaseSettings):
     )
     MAIL_USERNAME: str
     MAIL_PASSWORD: SecretStr
+    SMTP_POOL_SIZE: int = 4
+    DIGEST_INTERVAL_MINUTES: int = 60
+    # How far back the first digest of a user looks
+    DIGEST_LOOKBACK_HOURS: int = 24
+    DIGEST_BATCH: int = 500
+    DIGEST_MAX_CHATS: int = 10
 
 
 mail_config = Settings()
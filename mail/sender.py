@@ -0,0 +1,53 @@
+import asyncio
+from email.message import EmailMessage
+
+import aiosmtplib
+from fastapi_mail import ConnectionConfig
+
+
+class SMTPPool:
+    """
+    A few long-lived SMTP connections for bulk mail, configured from the same
+    ConnectionConfig as FastMail. Connections are opened on first use and reopened
+    once when the server has dropped them.
+    """
+
+    def __init__(self, config: ConnectionConfig, size: int):
+        self.config = config
+        self.idle: asyncio.Queue = asyncio.Queue()
+        for _ in range(size):
+            self.idle.put_nowait(aiosmtplib.SMTP(hostname=config.MAIL_SERVER, port=config.MAIL_PORT,
+                                                 use_tls=config.MAIL_SSL_TLS, start_tls=config.MAIL_STARTTLS,
+                                                 validate_certs=config.VALIDATE_CERTS))
+
+    async def _connect(self, client: aiosmtplib.SMTP):
+        await client.connect()
+        if self.config.USE_CREDENTIALS:
+            await client.login(self.config.MAIL_USERNAME, self.config.MAIL_PASSWORD.get_secret_value())
+
+    async def send(self, recipient: str, subject: str, body: str):
+        message = EmailMessage()
+        message["From"] = str(self.config.MAIL_FROM)
+        message["To"] = recipient
+        message["Subject"] = subject
+        message.set_content(body)
+        client = await self.idle.get()
+        try:
+            if not client.is_connected:
+                await self._connect(client)
+            try:
+                await client.send_message(message)
+            except aiosmtplib.SMTPServerDisconnected:
+                await self._connect(client)
+                await client.send_message(message)
+        finally:
+            self.idle.put_nowait(client)
+
+    async def close(self):
+        while not self.idle.empty():
+            client = self.idle.get_nowait()
+            if client.is_connected:
+                try:
+                    await client.quit()
+                except aiosmtplib.SMTPException:
+                    client.close()
@@ -1,43 +1,212 @@
+import asyncio
 import mimetypes
 import string
 import random
 import uuid
-from datetime import timedelta
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Annotated, Optional, List
 import logging
 import aiofiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi_mail import MessageSchema, FastMail
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import selectinload
-from database.database_init import get_db
-from database.models import User, Project, Task, MessageType
+from database.database_init import get_db, engine, current_user_id
+from database.unit_of_work import UnitOfWorkMiddleware, unit_of_work, commit_current, release_current
+from database.acl import is_project_owner, is_project_member, is_task_member, owns_task
+from database.models import User, MessageType
 from mail.mail_config import conf
 from database.crud import AsyncORM
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Body
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Body, Query, Header, Request, Response
 import socketio
 from security import security
 import uvicorn
 from database import schemas, models
-
-app = FastAPI()
+from database.export import EXPORT_FORMATS, export_messages
+from database.partitions import partition_loop
+from database.stats import get_project_stats, get_burndown, snapshot_daily
+from database.warmup import warm_up
+from mail.digests import digest_loop
+from monitoring import admission, metrics, profiling
+from realtime.config import realtime_conf
+from realtime.membership import ChatMembership
+from realtime.notifications import NotificationBatcher
+from realtime.rate_limit import ConnectionLimiter
+from realtime.typing_events import TypingIndicators
+from realtime.wire import VariantEmitter, negotiate, room, FULL
+from scheduler.reminders import deadline_scheduler
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup_task = asyncio.create_task(warm_up_app())
+    typing_task = asyncio.create_task(typing_indicators.run())
+    lag_task = asyncio.create_task(metrics.sample_loop_lag(on_sample=admission.controller.loop_lag.record))
+    upload_cleanup_task = asyncio.create_task(clean_upload_sessions())
+    reminder_task = asyncio.create_task(deadline_scheduler.run(send_deadline_reminder))
+    stats_task = asyncio.create_task(snapshot_daily())
+    digest_task = asyncio.create_task(digest_loop())
+    partition_task = asyncio.create_task(partition_loop())
+    yield
+    partition_task.cancel()
+    digest_task.cancel()
+    warmup_task.cancel()
+    reminder_task.cancel()
+    stats_task.cancel()
+    typing_task.cancel()
+    lag_task.cancel()
+    upload_cleanup_task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False
+app.add_middleware(admission.AdmissionMiddleware)
 app.add_middleware(CORSMiddleware,
                    allow_origins="*",
                    allow_credentials=True,
                    allow_methods=["*"],
                    allow_headers=["*"],
                    )
+app.add_middleware(UnitOfWorkMiddleware)
+if profiling.PROFILING_ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 sio = socketio.AsyncServer(cors_allowed_origins='*', async_mode='asgi')
 socket_app = socketio.ASGIApp(sio, app)
+emitter = VariantEmitter(sio)
 logger = logging.getLogger("uvicorn.error")
 logger.setLevel(logging.DEBUG)
 UPLOAD_DIR = Path("uploads/")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+UPLOAD_SESSION_TTL = timedelta(hours=24)
+UPLOAD_CLEANUP_INTERVAL = 600
+
+
+async def emit_typing(chat_id: int, users: list[int]):
+    await emitter.emit("typing", f"chat_{chat_id}", {"chat_id": chat_id, "users": users})
+
+
+typing_indicators = TypingIndicators(emit_typing, interval=realtime_conf.TYPING_INTERVAL,
+                                     ttl=realtime_conf.TYPING_TTL)
+
+
+async def session_user(sid) -> Optional[int]:
+    session = await sio.get_session(sid)
+    user_id = session.get("user")
+    # Runs before the per-sid worker is created, so the worker inherits the user for read routing
+    current_user_id.set(user_id)
+    return user_id
+
+
+async def reject_event(sid, event: str, detail: str):
+    await sio.emit("error", {"event": event, "detail": detail}, to=sid)
+
+
+async def emit_notifications(user_id: int, events: list[dict]):
+    await emitter.emit("notifications", f"user_{user_id}", {"events": events})
+
+
+async def sender_and_chat(user_id: int, chat_id: int) -> tuple[dict, dict]:
+    """Nested user and chat dicts for clients on the full payload."""
+    user_db = await AsyncORM.get_user_by_id(user_id)
+    chat_db = await AsyncORM.get_single_chat(chat_id)
+    return schemas.UserSearchResult.from_orm(user_db).dict(), schemas.ChatInSocket.from_orm(chat_db).dict()
+
+
+notifications = NotificationBatcher(emit_notifications, window=realtime_conf.NOTIFICATION_WINDOW)
+membership = ChatMembership(AsyncORM.get_user_chat_ids, ttl=realtime_conf.MEMBERSHIP_HTTP_TTL,
+                            max_http_users=realtime_conf.MEMBERSHIP_HTTP_MAX_USERS,
+                            refresh=realtime_conf.MEMBERSHIP_REFRESH)
+
+
+async def send_deadline_reminder(task: dict, users: list[tuple[int, str]]):
+    notifications.notify([user_id for user_id, _ in users], {"type": "task_deadline", **task})
+    fm = FastMail(conf)
+    for _, email in users:
+        message = MessageSchema(
+            subject=f"Deadline approaching: {task['name']}",
+            recipients=[email],
+            body=f"Task \"{task['name']}\" is due at {task['time_end']}",
+            subtype="plain"
+        )
+        await fm.send_message(message)
+
+
+def id_of(data, field: str) -> Optional[int]:
+    """An id from the event as an int (clients may send "5"), None when missing or malformed."""
+    try:
+        return int(data.get(field))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def chat_id_of(data) -> Optional[int]:
+    return id_of(data, "chat_id")
+
+
+async def authorize_chat(sid, event: str, user_id: int, chat_id) -> bool:
+    if await membership.is_member(user_id, chat_id):
+        return True
+    await reject_event(sid, event, "Not a chat member")
+    return False
+
+
+limiter = ConnectionLimiter(realtime_conf.SID_RATE_LIMITS, realtime_conf.USER_RATE_LIMITS,
+                            realtime_conf.EVENT_QUEUE_SIZE, user_of=session_user, reject=reject_event)
+
+
+@metrics.registry.collector
+def collect_runtime_metrics():
+    pool = engine.pool
+    metrics.pool_connections.labels("checked_out").set(pool.checkedout())
+    metrics.pool_connections.labels("idle").set(pool.checkedin())
+    metrics.pool_connections.labels("overflow").set(max(0, pool.overflow()))
+    namespace_rooms = sio.manager.rooms.get("/", {})
+    metrics.connected_sids.set(len(namespace_rooms.get(None, ())))
+    sizes = {}
+    for name, participants in namespace_rooms.items():
+        if isinstance(name, str) and "_" in name:
+            sizes.setdefault(name.split("_", 1)[0], []).append(len(participants))
+    metrics.rooms.clear()
+    metrics.room_members.clear()
+    for kind, members in sizes.items():
+        metrics.rooms.labels(kind).set(len(members))
+        metrics.room_members.labels(kind, "total").set(sum(members))
+        metrics.room_members.labels(kind, "max").set(max(members))
+    for event, count in limiter.throttled.items():
+        metrics.socket_rejected.labels(event, "throttled").set(count)
+    for event, count in limiter.dropped.items():
+        metrics.socket_rejected.labels(event, "queue_full").set(count)
+
+
+async def warm_up_app():
+    try:
+        metrics.warmup_seconds.set(await warm_up())
+    except Exception:
+        logger.exception("Warm-up failed, serving with cold caches")
+    app.state.ready = True
+
+
+@app.get("/ready")
+async def ready():
+    if not app.state.ready:
+        raise HTTPException(
+            status_code=503,
+            detail="Warming up",
+            headers={"Retry-After": "1"}
+        )
+    return {"status": "ready"}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.post("/registration/")
@@ -106,6 +275,56 @@ async def get_all_chats(curr_user: User = Depends(security.get_current_user)):
     return await AsyncORM.get_all_chats(curr_user.id)
 
 
+@app.get("/chats/{chat_id}/messages", response_model=List[schemas.MessageOut])
+async def get_chat_history(chat_id: int, before: Optional[datetime] = None, limit: int = Query(50, ge=1, le=200),
+                           curr_user: User = Depends(security.get_current_user)):
+    if curr_user is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated"
+        )
+    return await AsyncORM.get_chat_history(chat_id, curr_user.id, before, limit)
+
+
+def export_response(batches, fmt: str, name: str) -> StreamingResponse:
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail="Unknown export format"
+        )
+    stream, media_type, extension = EXPORT_FORMATS[fmt]
+    return StreamingResponse(stream(batches), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{name}.{extension}"'})
+
+
+@app.get("/export/chats/{chat_id}")
+async def export_chat(chat_id: int, format: str = "ndjson", curr_user: User = Depends(security.get_current_user),
+                      db: AsyncSession = Depends(get_db)):
+    if curr_user is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated"
+        )
+    member = await db.execute(select(models.ChatMember).where(models.ChatMember.chat_id == chat_id,
+                                                              models.ChatMember.user_id == curr_user.id))
+    if member.scalars().first() is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Chat not found"
+        )
+    return export_response(export_messages(chat_id=chat_id), format, f"chat_{chat_id}")
+
+
+@app.get("/export/user")
+async def export_user(format: str = "ndjson", curr_user: User = Depends(security.get_current_user)):
+    if curr_user is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated"
+        )
+    return export_response(export_messages(user_id=curr_user.id), format, f"user_{curr_user.id}")
+
+
 @app.post("/chats/", response_model=schemas.ChatOut)
 async def create_chat(photo: UploadFile = File(None), name: Optional[str] = Form(),
                       type: str = Form(),
@@ -128,9 +347,11 @@ async def create_chat(photo: UploadFile = File(None), name: Optional[str] = Form
                 if not chunk:
                     break
                 await buffer.write(chunk)
+                metrics.upload_bytes.inc(len(chunk))
     photo_chat = str(file_location) if photo else None
     chat_db = await AsyncORM.create_chat(name=name, members=members, photo=photo_chat,
                                          type=type)
+    membership.add(chat_db.id, [member.id for member in chat_db.members])
     return chat_db
 
 
@@ -140,6 +361,17 @@ async def ret_all_prj(curr_user: User = Depends(security.get_current_user)):
     return user
 
 
+@app.get("/users/search", response_model=List[schemas.UserSearchResult])
+async def search_users(q: str = Query(min_length=1, max_length=100), limit: int = Query(20, ge=1, le=50),
+                       curr_user: User = Depends(security.get_current_user)):
+    if curr_user is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated"
+        )
+    return await AsyncORM.search_users(curr_user.id, q.strip(), limit)
+
+
 @app.get("/user/{user_id}", response_model=schemas.UserSearchResult)
 async def search(user_id: int, curr_user: User = Depends(security.get_current_user),
                  db: AsyncSession = Depends(get_db)):
@@ -182,6 +414,7 @@ async def user_update(photo: UploadFile = File(None), first_name: str = Form(Non
                 if not chunk:
                     break
                 await buffer.write(chunk)
+                metrics.upload_bytes.inc(len(chunk))
         user.photo = str(file_location)
     if first_name:
         user.first_name = first_name
@@ -224,19 +457,40 @@ async def create_project(new_project: schemas.ProjectCreate, curr_user: User = D
     return project_db
 
 
+@app.get("/projects/{project_id}/stats", response_model=schemas.ProjectStatsOut)
+async def project_stats(project_id: int, curr_user: User = Depends(security.get_current_user)):
+    if not await is_project_member(project_id, curr_user.id):
+        raise HTTPException(
+            status_code=404,
+            detail="Project not found"
+        )
+    return await get_project_stats(project_id)
+
+
+@app.get("/projects/{project_id}/burndown", response_model=List[schemas.ProjectStatsDayOut])
+async def project_burndown(project_id: int, days: int = Query(30, ge=1, le=366),
+                           curr_user: User = Depends(security.get_current_user)):
+    if not await is_project_member(project_id, curr_user.id):
+        raise HTTPException(
+            status_code=404,
+            detail="Project not found"
+        )
+    return await get_burndown(project_id, days)
+
+
 @app.post("/projects/{project_id}/task", response_model=schemas.TaskOut)
 async def create_task(project_id: int, new_task: schemas.TaskCreate, curr_user: User = Depends(
-    security.get_current_user), db: AsyncSession = Depends(get_db)):
-    query = select(Project).options(selectinload(Project.owner).load_only(User.id)).where(Project.id == project_id)
-    res = await db.execute(query)
-    result = res.scalars().first()
-    if result.owner.id != curr_user.id:
+    security.get_current_user)):
+    if not await is_project_owner(project_id, curr_user.id):
         raise HTTPException(
             status_code=403,
             detail="Only owner can create task"
         )
     logger.info(new_task)
     task = await AsyncORM.create_task(new_task, project_id)
+    await commit_current()
+    notifications.notify([user.id for user in task.assigned if user.id != curr_user.id],
+                         {"type": "task_assigned", "project_id": project_id, "task_id": task.id, "name": task.name})
     return task
 
 
@@ -247,55 +501,164 @@ async def upload_file(chat_id: int, file: UploadFile = File(), curr_user: User =
             status_code=401,
             detail="Not authenticated"
         )
+    if not await membership.is_member(curr_user.id, chat_id):
+        raise HTTPException(
+            status_code=403,
+            detail="Not a chat member"
+        )
     unique_suffix = uuid.uuid4().hex
     original_filename = Path(file.filename)
     filename = f"{original_filename.stem}_{unique_suffix}{original_filename.suffix}"
     file_location = UPLOAD_DIR / filename
+    await release_current()
     async with aiofiles.open(file_location, "wb") as buffer:
         while True:
             chunk = await file.read(1024)
             if not chunk:
                 break
             await buffer.write(chunk)
-    file_type, _ = mimetypes.guess_type(file.filename)
+            metrics.upload_bytes.inc(len(chunk))
+    await send_file_message(curr_user, chat_id, file.filename, str(file_location))
+    return 201
+
+
+async def send_file_message(curr_user: User, chat_id: int, original_filename: str, file_location: str) -> int:
+    file_type, _ = mimetypes.guess_type(original_filename)
     if file_type and file_type.startswith("image/"):
         file_type = "image"
     else:
         file_type = "file"
-    timestamp, msg_id = await AsyncORM.create_message(None, str(file_location), curr_user.id, chat_id,
+    timestamp, msg_id = await AsyncORM.create_message(None, file_location, curr_user.id, chat_id,
                                                       type=file_type)
-    user = schemas.UserSearchResult.from_orm(curr_user).dict()
-    chat_db = await AsyncORM.get_single_chat(chat_id)
-    chat = schemas.ChatInSocket.from_orm(chat_db).dict()
-    await sio.emit("new_message", {"user": user, "chat": chat, "filename": file.filename, "message_id": msg_id,
-                                   "type": file_type,
-                                   "timestamp": timestamp.utcnow().isoformat(),
-                                   "url": str(file_location)},
-                   room=f"chat_{chat_id}")
-    return 201
+    await commit_current()
 
+    async def full():
+        user, chat = await sender_and_chat(curr_user.id, chat_id)
+        return {"user": user, "chat": chat, "filename": original_filename, "message_id": msg_id,
+                "type": file_type,
+                "timestamp": timestamp.utcnow().isoformat(),
+                "url": file_location}
 
-@app.delete("/projects/{project_id}/task/{task_id}")
-async def remove_task(project_id: int, task_id: int, curr_user: User = Depends(security.get_current_user),
-                      db: AsyncSession = Depends(get_db)):
+    await emitter.emit("new_message", f"chat_{chat_id}",
+                       {"id": msg_id, "chat_id": chat_id, "user_id": curr_user.id, "type": file_type,
+                        "filename": original_filename, "url": file_location, "timestamp": timestamp.isoformat()},
+                       full)
+    return msg_id
+
+
+@app.post("/upload_sessions/{chat_id}", response_model=schemas.UploadSessionOut, status_code=201)
+async def create_upload_session(chat_id: int, upload: schemas.UploadSessionCreate,
+                                curr_user: User = Depends(security.get_current_user)):
     if curr_user is None:
         raise HTTPException(
             status_code=401,
             detail="Not authenticated"
         )
-    query = select(Project).options(selectinload(Project.owner).load_only(User.id)
-                                    , selectinload(Project.tasks).load_only(Task.id)
-                                    ).where(Project.id == project_id)
-    prj = (await db.execute(query)).scalars().first()
-    if prj.owner.id != curr_user.id:
+    if not await membership.is_member(curr_user.id, chat_id):
         raise HTTPException(
-            status_code=404,
-            detail="Only owner can remove projects"
+            status_code=403,
+            detail="Not a chat member"
         )
-    if task_id not in [i.id for i in prj.tasks]:
+    if upload.size <= 0:
         raise HTTPException(
             status_code=400,
-            detail="Project id and task id dont match"
+            detail="Upload size must be positive"
+        )
+    upload_id = uuid.uuid4().hex
+    original_filename = Path(upload.filename)
+    file_location = UPLOAD_DIR / f"{original_filename.stem}_{upload_id}{original_filename.suffix}"
+    # Chunks are written in place at their offsets, so the final file exists from the start
+    async with aiofiles.open(file_location, "wb"):
+        pass
+    return await AsyncORM.create_upload_session(upload_id, curr_user.id, chat_id, upload.filename,
+                                                str(file_location), upload.size)
+
+
+@app.head("/upload_sessions/{upload_id}")
+async def get_upload_offset(upload_id: str, curr_user: User = Depends(security.get_current_user)):
+    upload = await AsyncORM.get_upload_session(upload_id, curr_user.id)
+    return Response(headers={"Upload-Offset": str(upload.offset), "Upload-Length": str(upload.size),
+                             "Cache-Control": "no-store"})
+
+
+@app.patch("/upload_sessions/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, upload_offset: int = Header(),
+                       curr_user: User = Depends(security.get_current_user)):
+    upload = await AsyncORM.get_upload_session(upload_id, curr_user.id)
+    if upload_offset != upload.offset:
+        raise HTTPException(
+            status_code=409,
+            detail="Offset mismatch",
+            headers={"Upload-Offset": str(upload.offset)}
+        )
+    # Don't hold a pooled connection idle in transaction while the body trickles in
+    await release_current()
+    written = 0
+    async with aiofiles.open(upload.path, "r+b") as buffer:
+        await buffer.seek(upload_offset)
+        async for chunk in request.stream():
+            if upload_offset + written + len(chunk) > upload.size:
+                raise HTTPException(
+                    status_code=413,
+                    detail="Chunk exceeds upload size"
+                )
+            await buffer.write(chunk)
+            written += len(chunk)
+            metrics.upload_bytes.inc(len(chunk))
+    if written and not await AsyncORM.advance_upload_session(upload_id, upload_offset, written):
+        raise HTTPException(
+            status_code=409,
+            detail="Concurrent upload to the same offset"
+        )
+    return Response(status_code=204, headers={"Upload-Offset": str(upload_offset + written)})
+
+
+@app.post("/upload_sessions/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, curr_user: User = Depends(security.get_current_user)):
+    upload = await AsyncORM.get_upload_session(upload_id, curr_user.id)
+    if upload.offset != upload.size:
+        raise HTTPException(
+            status_code=409,
+            detail="Upload is incomplete",
+            headers={"Upload-Offset": str(upload.offset)}
+        )
+    if not await membership.is_member(curr_user.id, upload.chat_id):
+        raise HTTPException(
+            status_code=403,
+            detail="Not a chat member"
+        )
+    if not await AsyncORM.delete_upload_session(upload_id):
+        raise HTTPException(
+            status_code=409,
+            detail="Upload already finalized"
+        )
+    msg_id = await send_file_message(curr_user, upload.chat_id, upload.filename, upload.path)
+    return {"message_id": msg_id}
+
+
+async def clean_upload_sessions():
+    while True:
+        await asyncio.sleep(UPLOAD_CLEANUP_INTERVAL)
+        try:
+            paths = await AsyncORM.delete_stale_upload_sessions(datetime.utcnow() - UPLOAD_SESSION_TTL)
+        except Exception:
+            logger.exception("Upload session cleanup failed")
+            continue
+        for path in paths:
+            Path(path).unlink(missing_ok=True)
+
+
+@app.delete("/projects/{project_id}/task/{task_id}")
+async def remove_task(project_id: int, task_id: int, curr_user: User = Depends(security.get_current_user)):
+    if curr_user is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated"
+        )
+    if not await owns_task(project_id, task_id, curr_user.id):
+        raise HTTPException(
+            status_code=404,
+            detail="Task not found in your project"
         )
     await AsyncORM.remove_task(task_id)
     return 201
@@ -309,32 +672,81 @@ async def create_comment(task_id: int, comment: schemas.CommentsCreate, curr_use
             status_code=401,
             detail="Not authenticated"
         )
-    await AsyncORM.create_comment(comment.content, curr_user.id, task_id)
+    if not await is_task_member(task_id, curr_user.id):
+        raise HTTPException(
+            status_code=404,
+            detail="Task not found"
+        )
+    await AsyncORM.create_comment(comment.content, curr_user.id, task_id, comment.parent_comment_id)
+    audience = await AsyncORM.get_task_audience(task_id)
+    await commit_current()
+    notifications.notify(audience - {curr_user.id},
+                         {"type": "task_comment", "task_id": task_id, "user_id": curr_user.id,
+                          "parent_comment_id": comment.parent_comment_id})
     return 201
 
 
+@app.get("/tasks/calendar", response_model=List[schemas.CalendarTaskOut])
+async def get_calendar(time_from: datetime = Query(alias="from"), time_to: datetime = Query(alias="to"),
+                       curr_user: User = Depends(security.get_current_user)):
+    if curr_user is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated"
+        )
+    if time_to <= time_from:
+        raise HTTPException(
+            status_code=400,
+            detail="Empty time window"
+        )
+    return await AsyncORM.get_calendar(curr_user.id, time_from, time_to)
+
+
+@app.get("/tasks/{task_id}/comments", response_model=List[schemas.CommentThreadOut])
+async def get_comments(task_id: int, parent_id: Optional[int] = None, offset: int = Query(0, ge=0),
+                       limit: int = Query(20, ge=1, le=100), depth: int = Query(3, ge=0, le=10),
+                       replies: int = Query(5, ge=0, le=50), curr_user: User = Depends(security.get_current_user)):
+    if curr_user is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated"
+        )
+    if not await is_task_member(task_id, curr_user.id):
+        raise HTTPException(
+            status_code=404,
+            detail="Task not found"
+        )
+    return await AsyncORM.get_comment_thread(task_id, parent_id, offset, limit, depth, replies)
+
+
 @app.put("/projects/{project_id}/task/{task_id}", response_model=schemas.TaskOut)
 async def update_task(project_id: int, task_id: int, task: schemas.TaskUpdate, curr_user: User = Depends(
-    security.get_current_user), db: AsyncSession = Depends(get_db)):
+    security.get_current_user)):
     if curr_user is None:
         raise HTTPException(
             status_code=401,
             detail="Not authenticated"
         )
-    query = select(Project).options(selectinload(Project.owner).load_only(User.id)
-                                    , selectinload(Project.tasks).load_only(Task.id)
-                                    ).where(Project.id == project_id)
-    prj = (await db.execute(query)).scalars().first()
-    if prj.owner.id != curr_user.id:
+    if not await owns_task(project_id, task_id, curr_user.id):
         raise HTTPException(
             status_code=404,
-            detail="Only owner can update projects"
+            detail="Task not found in your project"
         )
-    updated_task = await AsyncORM.update_task(task_id, task)
+    updated_task, previous = await AsyncORM.update_task(task_id, task)
+    assigned = {user.id for user in updated_task.assigned}
+    await commit_current()
+    notifications.notify(assigned - previous["assigned"] - {curr_user.id},
+                         {"type": "task_assigned", "project_id": project_id, "task_id": task_id,
+                          "name": updated_task.name})
+    if updated_task.status != previous["status"]:
+        notifications.notify((assigned | previous["assigned"]) - {curr_user.id},
+                             {"type": "task_status", "project_id": project_id, "task_id": task_id,
+                              "status": updated_task.status.value})
     return updated_task
 
 
 @sio.on("connect")
+@metrics.timed_event("connect")
 async def connection(sid, environ, auth: dict):
     if not auth:
         await sio.disconnect(sid)
@@ -344,68 +756,250 @@ async def connection(sid, environ, auth: dict):
         await sio.disconnect(sid)
         return False
     try:
-        user = await security.get_current_user(token)
+        async with unit_of_work():
+            user = await security.get_current_user(token)
+            await AsyncORM.update_online(user.id, True)
+            await membership.acquire(user.id)
     except HTTPException:
         await sio.disconnect(sid)
         return False
-    await AsyncORM.update_online(user.id, True)
-    await sio.save_session(sid, {"user": user.id})
+    wire = negotiate(auth)
+    await sio.save_session(sid, {"user": user.id, "wire": wire})
+    await sio.enter_room(sid, room(f"user_{user.id}", wire))
+    # Plain JSON, so a client that asked for msgpack learns whether it fell back to slim JSON
+    await sio.emit("wire_format", {"format": wire}, to=sid)
     await sio.emit("connect", {"data": "User connected"})
 
 
 @sio.on("new_message")
+@admission.admit_event("new_message", reject_event)
+@limiter.guard("new_message")
+@metrics.timed_event("new_message")
+@profiling.profiled_event("new_message")
 async def message_handler(sid, data: dict):
     session = await sio.get_session(sid)
     user_id = session.get("user")
     message = data.get("message")
-    chat_id = data.get("chat_id")
+    chat_id = chat_id_of(data)
     if message and chat_id:
-        timestamp, msg_id = await AsyncORM.create_message(message, None, user_id, chat_id, type="text")
-        user_db = await AsyncORM.get_user_by_id(user_id)
-        user = schemas.UserSearchResult.from_orm(user_db).dict()
-        chat_db = await AsyncORM.get_single_chat(chat_id)
-        chat = schemas.ChatInSocket.from_orm(chat_db).dict()
-        await sio.emit("new_message", {"user": user, "chat": chat, "message": message, "message_id": msg_id,
-                                       "type": "text",
-                                       "timestamp": timestamp.utcnow().isoformat()},
-                       room=f"chat_{chat_id}")
+        if not await authorize_chat(sid, "new_message", user_id, chat_id):
+            return
+        async with unit_of_work():
+            timestamp, msg_id = await AsyncORM.create_message(message, None, user_id, chat_id, type="text")
+
+        async def full():
+            user, chat = await sender_and_chat(user_id, chat_id)
+            return {"user": user, "chat": chat, "message": message, "message_id": msg_id,
+                    "type": "text",
+                    "timestamp": timestamp.utcnow().isoformat()}
+
+        await emitter.emit("new_message", f"chat_{chat_id}",
+                           {"id": msg_id, "chat_id": chat_id, "user_id": user_id, "type": "text",
+                            "content": message, "timestamp": timestamp.isoformat()},
+                           full)
 
 
 @sio.on("begin_chat")
+@admission.admit_event("begin_chat", reject_event)
+@limiter.guard("begin_chat")
+@metrics.timed_event("begin_chat")
+@profiling.profiled_event("begin_chat")
 async def begin_chat(sid, data: dict):
-    chat_id = data.get("chat_id")
-    if chat_id:
-        await sio.enter_room(sid, f"chat_{chat_id}")
+    session = await sio.get_session(sid)
+    user_id = session.get("user")
+    chat_id = chat_id_of(data)
+    if chat_id and await authorize_chat(sid, "begin_chat", user_id, chat_id):
+        await sio.enter_room(sid, room(f"chat_{chat_id}", session.get("wire", FULL)))
 
 
 @sio.on("leave_chat")
+@admission.admit_event("leave_chat", reject_event)
+@limiter.guard("leave_chat")
+@metrics.timed_event("leave_chat")
+@profiling.profiled_event("leave_chat")
 async def leave_chat(sid, data: dict):
-    chat_id = data.get("chat_id")
+    session = await sio.get_session(sid)
+    chat_id = chat_id_of(data)
     if chat_id:
-        await sio.leave_room(sid, f"chat_{chat_id}")
+        await sio.leave_room(sid, room(f"chat_{chat_id}", session.get("wire", FULL)))
 
 
 @sio.on("set_reaction")
+@admission.admit_event("set_reaction", reject_event)
+@limiter.guard("set_reaction")
+@metrics.timed_event("set_reaction")
+@profiling.profiled_event("set_reaction")
 async def reaction(sid, data: dict):
     session = await sio.get_session(sid)
     user_id = session.get("user")
-    chat_id = data.get("chat_id")
+    chat_id = chat_id_of(data)
     reaction_id = data.get("reaction_id")
-    msg_id = data.get("message_id")
+    msg_id = id_of(data, "message_id")
     if reaction_id and msg_id and chat_id:
-        await AsyncORM.create_reaction(reaction_id, msg_id, user_id)
-        user_db = await AsyncORM.get_user_by_id(user_id)
-        user = schemas.UserSearchResult.from_orm(user_db).dict()
-        chat_db = await AsyncORM.get_single_chat(chat_id)
-        chat = schemas.ChatInSocket.from_orm(chat_db).dict()
-        await sio.emit("set_reaction", {"user": user, "chat": chat, "message_id": msg_id, "reaction": reaction_id})
+        if not await authorize_chat(sid, "set_reaction", user_id, chat_id):
+            return
+        async with unit_of_work():
+            created = await AsyncORM.create_reaction(reaction_id, msg_id, user_id, chat_id)
+        if not created:
+            await reject_event(sid, "set_reaction", "Message not found")
+            return
+
+        async def full():
+            user, chat = await sender_and_chat(user_id, chat_id)
+            return {"user": user, "chat": chat, "message_id": msg_id, "reaction": reaction_id}
+
+        await emitter.emit("set_reaction", f"chat_{chat_id}",
+                           {"message_id": msg_id, "chat_id": chat_id, "user_id": user_id, "reaction": reaction_id},
+                           full)
+
+
+BATCH_OPS = {
+    "message": ("chat_id", "message"),
+    "reaction": ("chat_id", "reaction_id"),
+    "read": ("chat_id", "message_id"),
+}
+
+
+@sio.on("batch")
+@admission.admit_event("batch", reject_event)
+@limiter.guard("batch")
+@metrics.timed_event("batch")
+@profiling.profiled_event("batch")
+async def batch(sid, data: dict):
+    """
+    Ordered messages, reactions and read markers queued by a client while offline.
+    Persisted in one transaction, announced with one "batch" emit per chat and acked
+    per op. A reaction may target a message of the same batch by its op index ("message_ref");
+    one naming a message_id missing from its chat is acked with "Message not found".
+    """
+    session = await sio.get_session(sid)
+    user_id = session.get("user")
+    ops = data.get("ops") if isinstance(data, dict) else None
+    if not isinstance(ops, list) or not ops or len(ops) > realtime_conf.BATCH_MAX_OPS:
+        await reject_event(sid, "batch", "Invalid batch")
+        return
+    results = [{"ok": False, "error": "Invalid operation"} for _ in ops]
+    valid = []
+    for index, op in enumerate(ops):
+        if not isinstance(op, dict) or op.get("op") not in BATCH_OPS:
+            continue
+        op["chat_id"] = chat_id_of(op)
+        if not all(op.get(field) for field in BATCH_OPS[op["op"]]):
+            continue
+        if op["op"] == "message" and not isinstance(op["message"], str):
+            continue
+        if op["op"] == "reaction" and op.get("message_id") is not None:
+            op["message_id"] = id_of(op, "message_id")
+            if not op["message_id"]:
+                continue
+        elif op["op"] == "reaction":
+            ref = op.get("message_ref")
+            if ref not in valid or ops[ref]["op"] != "message" or ops[ref]["chat_id"] != op["chat_id"]:
+                continue
+        if not await membership.is_member(user_id, op["chat_id"]):
+            results[index] = {"ok": False, "error": "Not a chat member"}
+            continue
+        valid.append(index)
+
+    by_kind = {kind: [index for index in valid if ops[index]["op"] == kind] for kind in BATCH_OPS}
+    try:
+        async with unit_of_work():
+            created = dict(zip(by_kind["message"], await AsyncORM.create_messages(
+                [{"user_id": user_id, "chat_id": ops[index]["chat_id"], "content": ops[index]["message"]}
+                 for index in by_kind["message"]]))) if by_kind["message"] else {}
+            reacted: dict[int, list[int]] = {}
+            for index in by_kind["reaction"]:
+                if ops[index].get("message_id"):
+                    reacted.setdefault(ops[index]["chat_id"], []).append(ops[index]["message_id"])
+            in_chat = {(chat_id, message_id) for chat_id, message_ids in reacted.items()
+                       for message_id in await AsyncORM.chat_message_ids(chat_id, message_ids)}
+            targets = {index: ops[index].get("message_id") or created[ops[index]["message_ref"]][0]
+                       for index in by_kind["reaction"]
+                       if not ops[index].get("message_id") or (ops[index]["chat_id"], ops[index]["message_id"]) in in_chat}
+            if targets:
+                await AsyncORM.create_reactions([{"content": ops[index]["reaction_id"], "message_id": message_id,
+                                                  "user_id": user_id} for index, message_id in targets.items()])
+            reads: dict[int, list[int]] = {}
+            for index in by_kind["read"]:
+                reads.setdefault(ops[index]["chat_id"], []).append(ops[index]["message_id"])
+            found = set()
+            for chat_id, message_ids in reads.items():
+                marked = await AsyncORM.mark_read(user_id, chat_id, message_ids)
+                found |= {(chat_id, message_id) for message_id in marked}
+    except Exception:
+        logger.exception("Batch from %s failed", sid)
+        for index in valid:
+            results[index] = {"ok": False, "error": "Batch failed"}
+        return {"batch_id": data.get("batch_id"), "results": results}
+
+    events: dict[int, list[dict]] = {}
+    for index in valid:
+        op = ops[index]
+        chat_id = op["chat_id"]
+        if op["op"] == "message":
+            msg_id, timestamp = created[index]
+            event = {"event": "new_message", "id": msg_id, "chat_id": chat_id, "user_id": user_id, "type": "text",
+                     "content": op["message"], "timestamp": timestamp.isoformat()}
+        elif op["op"] == "reaction":
+            if index not in targets:
+                results[index] = {"ok": False, "error": "Message not found"}
+                continue
+            msg_id = targets[index]
+            event = {"event": "set_reaction", "message_id": msg_id, "chat_id": chat_id, "user_id": user_id,
+                     "reaction": op["reaction_id"]}
+        else:
+            msg_id = op["message_id"]
+            if (chat_id, msg_id) not in found:
+                results[index] = {"ok": False, "error": "Message not found"}
+                continue
+            event = {"event": "read", "message_id": msg_id, "chat_id": chat_id, "user_id": user_id}
+        results[index] = {"ok": True, "message_id": msg_id}
+        events.setdefault(chat_id, []).append(event)
+
+    for chat_id, chat_events in events.items():
+        async def full(chat_id=chat_id, chat_events=chat_events):
+            user, chat = await sender_and_chat(user_id, chat_id)
+            return {"chat_id": chat_id, "user": user, "chat": chat, "events": chat_events}
+
+        await emitter.emit("batch", f"chat_{chat_id}", {"chat_id": chat_id, "events": chat_events}, full)
+    return {"batch_id": data.get("batch_id"), "results": results}
+
+
+@sio.on("typing")
+@admission.admit_event("typing", reject_event)
+@limiter.guard("typing")
+@metrics.timed_event("typing")
+@profiling.profiled_event("typing")
+async def typing(sid, data: dict):
+    session = await sio.get_session(sid)
+    user_id = session.get("user")
+    chat_id = chat_id_of(data)
+    if user_id and chat_id and await authorize_chat(sid, "typing", user_id, chat_id):
+        typing_indicators.start(chat_id, user_id)
+
+
+@sio.on("stop_typing")
+@admission.admit_event("stop_typing", reject_event)
+@limiter.guard("stop_typing")
+@metrics.timed_event("stop_typing")
+@profiling.profiled_event("stop_typing")
+async def stop_typing(sid, data: dict):
+    session = await sio.get_session(sid)
+    user_id = session.get("user")
+    chat_id = chat_id_of(data)
+    if user_id and chat_id:
+        typing_indicators.stop(chat_id, user_id)
 
 
 @sio.on("disconnect")
+@metrics.timed_event("disconnect")
 async def disconnect(sid):
     session = await sio.get_session(sid)
     user_id = session.get("user")
+    limiter.close(sid, user_id)
     if user_id:
+        membership.release(user_id)
+        typing_indicators.drop_user(user_id)
         await AsyncORM.update_online(user_id, False)
 
 
@@ -0,0 +1,130 @@
+import asyncio
+import functools
+import math
+import time
+from typing import Awaitable, Callable
+
+from monitoring import metrics
+from monitoring.config import monitoring_conf
+
+CRITICAL, NORMAL, LOW = "critical", "normal", "low"
+
+
+class Signal:
+    """Exponentially smoothed samples that also decay toward zero while no samples arrive."""
+
+    def __init__(self, alpha: float = 0.2, half_life: float = 2.0):
+        self.alpha = alpha
+        self.decay = math.log(2) / half_life
+        self.value = 0.0
+        self.updated = time.monotonic()
+
+    def current(self) -> float:
+        return self.value * math.exp(-self.decay * (time.monotonic() - self.updated))
+
+    def record(self, sample: float):
+        value = self.current()
+        self.value = value + self.alpha * (sample - value)
+        self.updated = time.monotonic()
+
+
+class AdmissionController:
+    """
+    Sheds work by priority class while the DB pool or the event loop is saturated.
+    Elevated pressure sheds low priority work; overload delays normal work up to
+    max_delay and sheds it if the overload persists. Critical work is always admitted.
+    """
+
+    def __init__(self, pool_wait: tuple[float, float], loop_lag: tuple[float, float], max_delay: float,
+                 critical_routes: list[str], low_routes: list[str],
+                 critical_events: list[str], low_events: list[str]):
+        self.pool_wait_limits = pool_wait
+        self.loop_lag_limits = loop_lag
+        self.max_delay = max_delay
+        self.pool_wait = Signal()
+        self.loop_lag = Signal()
+        self.waiting = 0  # checkouts currently blocked on an exhausted pool
+        self.routes = [(tuple(route.split(" ", 1)), CRITICAL) for route in critical_routes] + \
+                      [(tuple(route.split(" ", 1)), LOW) for route in low_routes]
+        self.events = {**{event: LOW for event in low_events}, **{event: CRITICAL for event in critical_events}}
+
+    def level(self) -> int:
+        wait, lag = self.pool_wait.current(), self.loop_lag.current()
+        if wait >= self.pool_wait_limits[1] or lag >= self.loop_lag_limits[1]:
+            return 2
+        if wait >= self.pool_wait_limits[0] or lag >= self.loop_lag_limits[0] or self.waiting:
+            return 1
+        return 0
+
+    def route_priority(self, method: str, path: str) -> str:
+        for (route_method, prefix), priority in self.routes:
+            if method == route_method and path.startswith(prefix):
+                return priority
+        return NORMAL
+
+    def event_priority(self, event: str) -> str:
+        return self.events.get(event, NORMAL)
+
+    async def admit(self, kind: str, priority: str) -> bool:
+        level = self.level()
+        if priority == CRITICAL or level == 0 or (level == 1 and priority == NORMAL):
+            decision = "admitted"
+        elif priority == NORMAL:
+            deadline = time.monotonic() + self.max_delay
+            while level == 2 and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                level = self.level()
+            decision = "delayed" if level < 2 else "shed"
+        else:
+            decision = "shed"
+        metrics.admission_decisions.labels(kind, priority, decision).inc()
+        return decision != "shed"
+
+
+controller = AdmissionController(monitoring_conf.ADMISSION_POOL_WAIT, monitoring_conf.ADMISSION_LOOP_LAG,
+                                 monitoring_conf.ADMISSION_MAX_DELAY,
+                                 monitoring_conf.CRITICAL_ROUTES, monitoring_conf.LOW_ROUTES,
+                                 monitoring_conf.CRITICAL_EVENTS, monitoring_conf.LOW_EVENTS)
+
+
+@metrics.registry.collector
+def collect_admission_metrics():
+    metrics.admission_level.set(controller.level())
+    metrics.admission_signal.labels("pool_wait").set(controller.pool_wait.current())
+    metrics.admission_signal.labels("loop_lag").set(controller.loop_lag.current())
+
+
+class AdmissionMiddleware:
+    """Answers 503 with Retry-After for HTTP requests the controller sheds."""
+
+    BUSY = b'{"detail":"Server busy, retry later"}'
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if await controller.admit("http", controller.route_priority(scope["method"], scope["path"])):
+            await self.app(scope, receive, send)
+            return
+        await send({"type": "http.response.start", "status": 503,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(self.BUSY)).encode()),
+                                (b"retry-after", str(monitoring_conf.ADMISSION_RETRY_AFTER).encode())]})
+        await send({"type": "http.response.body", "body": self.BUSY})
+
+
+def admit_event(event: str, reject: Callable[[str, str, str], Awaitable]):
+    """Shed a Socket.IO event under pressure according to its priority class."""
+    priority = controller.event_priority(event)
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(sid, *args):
+            if await controller.admit("socket", priority):
+                return await handler(sid, *args)
+            await reject(sid, event, "Server busy, retry later")
+        return wrapper
+    return decorator
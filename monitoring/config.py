@@ -0,0 +1,37 @@
+import os
+from typing import Optional
+from pydantic import SecretStr
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+DOTENV = os.path.join(os.path.dirname(os.path.dirname(__file__)), "monitoring.env")
+
+
+class MonitoringSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        env_file=DOTENV,
+        env_file_encoding="utf-8"
+    )
+    PROFILE_TOKEN: Optional[SecretStr] = None
+    PROFILE_SAMPLE_RATE: float = 0.0
+    PROFILE_INTERVAL: float = 0.002
+    PROFILE_DIR: str = "profiles"
+    # (elevated, overloaded) thresholds in seconds for the smoothed pool wait and loop lag
+    ADMISSION_POOL_WAIT: tuple[float, float] = (0.05, 0.25)
+    ADMISSION_LOOP_LAG: tuple[float, float] = (0.05, 0.2)
+    # How long normal work may wait for an overload to clear before it is shed
+    ADMISSION_MAX_DELAY: float = 0.5
+    ADMISSION_RETRY_AFTER: int = 2
+    # "METHOD /path-prefix"; anything unlisted is normal priority
+    CRITICAL_ROUTES: list[str] = [
+        "POST /login", "POST /registration/", "POST /confirm", "GET /ready", "GET /metrics",
+        "POST /upload_file/", "POST /upload_sessions/", "PATCH /upload_sessions/", "HEAD /upload_sessions/",
+    ]
+    LOW_ROUTES: list[str] = [
+        "GET /chats/", "GET /projects", "GET /export/", "GET /tasks/", "GET /users/search",
+    ]
+    CRITICAL_EVENTS: list[str] = ["new_message", "batch", "set_reaction"]
+    LOW_EVENTS: list[str] = ["typing", "stop_typing"]
+
+
+monitoring_conf = MonitoringSettings()
@@ -0,0 +1,267 @@
+import asyncio
+import bisect
+import functools
+import time
+from contextvars import ContextVar
+from typing import Callable, Iterable, Optional
+
+CHECKOUT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self.children: dict[tuple, object] = {}
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._child()
+        return child
+
+    def _child(self):
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self.children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: tuple, child) -> list[str]:
+        return [f"{self.name}{_labels(self.label_names, values)} {_number(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def clear(self):
+        self.children.clear()
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def _child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(self, values: tuple, child: _Buckets) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _number(bound)
+            labels = _labels(self.label_names, values, 'le="' + le + '"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _labels(self.label_names, values)
+        lines.append(f"{self.name}_sum{labels} {_number(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    """Plain in-process registry. Updates are dict lookups and integer adds, collectors run only on scrape."""
+
+    def __init__(self):
+        self.metrics: list[_Metric] = []
+        self.collectors: list[Callable[[], None]] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, func: Callable[[], None]):
+        self.collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            collect()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_latency = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")))
+socket_latency = registry.register(Histogram(
+    "socketio_event_duration_seconds", "Socket.IO handler latency by event", ("event",)))
+socket_errors = registry.register(Counter(
+    "socketio_event_errors_total", "Socket.IO handlers that raised", ("event",)))
+pool_wait = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled DB connection"))
+request_checkouts = registry.register(Histogram(
+    "db_pool_checkouts_per_request", "DB pool checkouts made by one HTTP request", ("route",), CHECKOUT_BUCKETS))
+event_checkouts = registry.register(Histogram(
+    "db_pool_checkouts_per_event", "DB pool checkouts made by one Socket.IO event", ("event",), CHECKOUT_BUCKETS))
+pool_connections = registry.register(Gauge(
+    "db_pool_connections", "DB pool connections by state", ("state",)))
+loop_lag = registry.register(Histogram(
+    "event_loop_lag_seconds", "Event loop scheduling delay", buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)))
+connected_sids = registry.register(Gauge(
+    "socketio_connected_sids", "Socket.IO connections on this worker"))
+rooms = registry.register(Gauge(
+    "socketio_rooms", "Socket.IO rooms by kind", ("kind",)))
+room_members = registry.register(Gauge(
+    "socketio_room_members", "Socket.IO room membership by kind, total and max", ("kind", "stat")))
+socket_rejected = registry.register(Counter(
+    "socketio_events_rejected_total", "Socket.IO events rejected by the rate limiter", ("event", "reason")))
+upload_bytes = registry.register(Counter(
+    "upload_bytes_total", "Bytes received through file uploads"))
+admission_decisions = registry.register(Counter(
+    "admission_decisions_total", "Admission decisions by priority class", ("kind", "priority", "decision")))
+admission_level = registry.register(Gauge(
+    "admission_pressure_level", "0 normal, 1 elevated (low priority shed), 2 overloaded (normal delayed or shed)"))
+admission_signal = registry.register(Gauge(
+    "admission_signal_seconds", "Smoothed overload signals used for admission", ("signal",)))
+warmup_seconds = registry.register(Gauge(
+    "app_warmup_seconds", "Time spent prefilling DB pools and warming statement caches at startup"))
+
+
+# Pool checkouts made within the current request or socket event, counted by the pool
+pool_checkouts: ContextVar[Optional[list[int]]] = ContextVar("pool_checkouts", default=None)
+
+
+def count_checkout():
+    counter = pool_checkouts.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def timed_event(event: str):
+    """Record handler latency for a Socket.IO event."""
+    def decorator(handler):
+        histogram = socket_latency.labels(event)
+        checkouts = event_checkouts.labels(event)
+
+        @functools.wraps(handler)
+        async def wrapper(*args):
+            start = time.perf_counter()
+            counter = [0]
+            token = pool_checkouts.set(counter)
+            try:
+                return await handler(*args)
+            except Exception:
+                socket_errors.labels(event).inc()
+                raise
+            finally:
+                pool_checkouts.reset(token)
+                histogram.observe(time.perf_counter() - start)
+                checkouts.observe(counter[0])
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request under its route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        counter = [0]
+        token = pool_checkouts.set(counter)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            pool_checkouts.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_latency.labels(scope["method"], route, status).observe(time.perf_counter() - start)
+            request_checkouts.labels(route).observe(counter[0])
+
+
+async def sample_loop_lag(interval: float = 0.5, on_sample: Optional[Callable[[float], None]] = None):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        loop_lag.observe(lag)
+        if on_sample is not None:
+            on_sample(lag)
@@ -0,0 +1,184 @@
+import asyncio
+import functools
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+from monitoring.config import monitoring_conf
+
+PROFILE_DIR = Path(monitoring_conf.PROFILE_DIR)
+PROFILE_TOKEN = monitoring_conf.PROFILE_TOKEN.get_secret_value() if monitoring_conf.PROFILE_TOKEN else None
+PROFILING_ENABLED = bool(PROFILE_TOKEN) or monitoring_conf.PROFILE_SAMPLE_RATE > 0
+
+CATEGORIES = (
+    ("db", ("sqlalchemy", "asyncpg")),
+    ("serialization", ("pydantic", "fastapi/encoders", "json", "serialize_response")),
+)
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.relpath(code.co_filename)}:{code.co_firstlineno})"
+
+
+class TaskProfiler:
+    """
+    Wall-clock sampler for a single asyncio task. A helper thread records the task's
+    stack every interval: the live thread stack while the task runs, the chain of
+    suspended coroutines while it awaits. Other tasks on the loop are not sampled.
+    Each sample is weighted by the wall time since the previous one, since the
+    sampler only gets the GIL when the loop thread releases it.
+    """
+
+    def __init__(self, task: asyncio.Task, interval: float = monitoring_conf.PROFILE_INTERVAL):
+        self.task = task
+        self.loop = task.get_loop()
+        self.root = task.get_coro().cr_code
+        self.thread_id = threading.get_ident()
+        self.interval = interval
+        self.samples: Counter = Counter()  # collapsed stack -> seconds
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.started = 0.0
+        self.elapsed = 0.0
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.thread.start()
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self.started
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            stack = self._stack()
+            now = time.perf_counter()
+            if stack:
+                self.samples[";".join(stack)] += now - last
+            last = now
+
+    def _stack(self) -> list[str]:
+        if asyncio.current_task(self.loop) is self.task:
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                frames.append(frame.f_code)
+                if frame.f_code is self.root:
+                    break
+                frame = frame.f_back
+            return [_frame_name(code) for code in reversed(frames)]
+        stack = []
+        awaitable = self.task.get_coro()
+        while awaitable is not None:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                break
+            stack.append(_frame_name(frame.f_code))
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        if stack:
+            stack.append("<await>")
+        return stack
+
+    def split(self) -> dict[str, float]:
+        """Wall-clock seconds per category (db, serialization, handler)."""
+        seconds = dict.fromkeys([name for name, _ in CATEGORIES] + ["handler"], 0.0)
+        for stack, spent in self.samples.items():
+            category = next((name for name, markers in CATEGORIES if any(m in stack for m in markers)), "handler")
+            seconds[category] += spent
+        return seconds
+
+    def _speedscope(self, name: str) -> dict:
+        frames: dict[str, int] = {}
+        samples, weights = [], []
+        for stack, spent in self.samples.items():
+            samples.append([frames.setdefault(frame, len(frames)) for frame in stack.split(";")])
+            weights.append(spent)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": [{"name": frame} for frame in frames]},
+            "profiles": [{"type": "sampled", "name": name, "unit": "seconds", "startValue": 0,
+                          "endValue": sum(weights), "samples": samples, "weights": weights}],
+        }
+
+    def dump(self, name: str, profile_id: str):
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        base = PROFILE_DIR / profile_id
+        with open(f"{base}.collapsed", "w", encoding="utf-8") as out:
+            for stack, spent in self.samples.most_common():
+                out.write(f"{stack} {round(spent * 1e6)}\n")
+        with open(f"{base}.speedscope.json", "w", encoding="utf-8") as out:
+            json.dump(self._speedscope(name), out)
+        with open(f"{base}.summary.json", "w", encoding="utf-8") as out:
+            json.dump({"name": name, "wall_seconds": self.elapsed, "interval": self.interval,
+                       "split_seconds": self.split()}, out, indent=2)
+
+
+def _requested(token: Optional[str]) -> bool:
+    if token and PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return random.random() < monitoring_conf.PROFILE_SAMPLE_RATE
+
+
+async def _profile(name: str, call):
+    profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    profiler = TaskProfiler(asyncio.current_task())
+    profiler.start()
+    try:
+        return await call(profile_id)
+    finally:
+        profiler.stop()
+        await asyncio.to_thread(profiler.dump, name, profile_id)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a request when it carries a valid X-Profile token or falls into
+    PROFILE_SAMPLE_RATE. Only installed when profiling is configured.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = dict(scope["headers"]).get(b"x-profile", b"").decode("latin-1")
+        if not _requested(token):
+            await self.app(scope, receive, send)
+            return
+
+        async def call(profile_id):
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+                await send(message)
+            await self.app(scope, receive, send_wrapper)
+
+        await _profile(f"{scope['method']} {scope['path']}", call)
+
+
+def profiled_event(event: str):
+    """Profile a Socket.IO handler when sampled or when the payload has a valid profile_token."""
+    def decorator(handler):
+        if not PROFILING_ENABLED:
+            return handler
+
+        @functools.wraps(handler)
+        async def wrapper(sid, data=None, *args):
+            token = data.get("profile_token") if isinstance(data, dict) else None
+            if not _requested(token):
+                return await handler(sid, data, *args)
+            return await _profile(f"socket {event}", lambda profile_id: handler(sid, data, *args))
+        return wrapper
+    return decorator
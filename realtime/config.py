@@ -0,0 +1,39 @@
+import os
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+DOTENV = os.path.join(os.path.dirname(os.path.dirname(__file__)), "realtime.env")
+
+
+class RealtimeSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        env_file=DOTENV,
+        env_file_encoding="utf-8"
+    )
+    TYPING_INTERVAL: float = 0.5
+    TYPING_TTL: float = 5.0
+    # event -> (tokens per second, burst)
+    SID_RATE_LIMITS: dict[str, tuple[float, float]] = {
+        "new_message": (5, 10),
+        "set_reaction": (5, 10),
+        "typing": (4, 8),
+        "stop_typing": (4, 8),
+        "begin_chat": (10, 20),
+        "leave_chat": (10, 20),
+        "batch": (1, 3),
+    }
+    USER_RATE_LIMITS: dict[str, tuple[float, float]] = {
+        "new_message": (10, 20),
+        "set_reaction": (10, 20),
+        "batch": (2, 5),
+    }
+    BATCH_MAX_OPS: int = 200
+    EVENT_QUEUE_SIZE: int = 32
+    NOTIFICATION_WINDOW: float = 0.25
+    # Chat membership cache: plain HTTP callers' entries, and the least time between reloads on a miss
+    MEMBERSHIP_HTTP_TTL: float = 60.0
+    MEMBERSHIP_HTTP_MAX_USERS: int = 10000
+    MEMBERSHIP_REFRESH: float = 5.0
+
+
+realtime_conf = RealtimeSettings()
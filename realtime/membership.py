@@ -0,0 +1,84 @@
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterable, Optional
+
+
+class ChatMembership:
+    """
+    In-memory index of chat ids per user, so socket handlers can authorize without
+    touching the database. Connected users are loaded at connect and kept until their
+    last socket closes; plain HTTP callers are kept for `ttl` seconds, at most
+    `max_http_users` of them, least recently used first out.
+
+    add() only reaches this worker. A chat created through another worker is picked up
+    by reloading the user's chats on a miss, at most once per `refresh` seconds.
+    """
+
+    def __init__(self, load: Callable[[int], Awaitable[Iterable[int]]], ttl: float = 60.0,
+                 max_http_users: int = 10000, refresh: float = 5.0):
+        self.load = load
+        self.ttl = ttl
+        self.max_http_users = max_http_users
+        self.refresh = refresh
+        self.chats: dict[int, set[int]] = {}
+        self.connections: dict[int, int] = {}
+        self.http_chats: OrderedDict[int, set[int]] = OrderedDict()
+        self.loaded_at: dict[int, float] = {}
+
+    async def acquire(self, user_id: int):
+        chats = set(await self.load(user_id))
+        self.http_chats.pop(user_id, None)
+        self.chats[user_id] = chats
+        self.loaded_at[user_id] = time.monotonic()
+        self.connections[user_id] = self.connections.get(user_id, 0) + 1
+
+    def release(self, user_id: int):
+        left = self.connections.get(user_id, 0) - 1
+        if left > 0:
+            self.connections[user_id] = left
+        else:
+            self.connections.pop(user_id, None)
+            self.chats.pop(user_id, None)
+            self.loaded_at.pop(user_id, None)
+
+    def add(self, chat_id: int, user_ids: Iterable[int]):
+        for user_id in user_ids:
+            chats = self.chats.get(user_id, self.http_chats.get(user_id))
+            if chats is not None:
+                chats.add(chat_id)
+
+    def _cached(self, user_id: int) -> Optional[set[int]]:
+        if user_id in self.chats:
+            return self.chats[user_id]
+        chats = self.http_chats.get(user_id)
+        if chats is None:
+            return None
+        if time.monotonic() - self.loaded_at[user_id] >= self.ttl:
+            del self.http_chats[user_id]
+            del self.loaded_at[user_id]
+            return None
+        self.http_chats.move_to_end(user_id)
+        return chats
+
+    async def _reload(self, user_id: int) -> set[int]:
+        chats = set(await self.load(user_id))
+        self.loaded_at[user_id] = time.monotonic()
+        if user_id in self.connections:
+            self.chats[user_id] = chats
+            return chats
+        self.http_chats[user_id] = chats
+        self.http_chats.move_to_end(user_id)
+        while len(self.http_chats) > self.max_http_users:
+            evicted, _ = self.http_chats.popitem(last=False)
+            del self.loaded_at[evicted]
+        return chats
+
+    async def is_member(self, user_id: int, chat_id) -> bool:
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            return False
+        chats = self._cached(user_id)
+        if chats is None or (chat_id not in chats and time.monotonic() - self.loaded_at[user_id] >= self.refresh):
+            chats = await self._reload(user_id)
+        return chat_id in chats
@@ -0,0 +1,43 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Iterable
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class NotificationBatcher:
+    """
+    Collects notifications per user. The first one opens a window, everything
+    arriving before it closes goes out as a single batched emit.
+    """
+
+    def __init__(self, emit: Callable[[int, list[dict]], Awaitable], window: float = 0.25):
+        self.emit = emit
+        self.window = window
+        self.pending: dict[int, list[dict]] = {}
+        # Flushes in progress, referenced until done so they are not garbage collected mid-emit
+        self.flushing: set[asyncio.Task] = set()
+
+    def notify(self, user_ids: Iterable[int], event: dict):
+        loop = asyncio.get_running_loop()
+        for user_id in user_ids:
+            events = self.pending.get(user_id)
+            if events is None:
+                events = self.pending[user_id] = []
+                loop.call_later(self.window, self._start_flush, user_id)
+            events.append(event)
+
+    def _start_flush(self, user_id: int):
+        task = asyncio.create_task(self.flush(user_id))
+        self.flushing.add(task)
+        task.add_done_callback(self._flushed)
+
+    def _flushed(self, task: asyncio.Task):
+        self.flushing.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Notification flush failed", exc_info=task.exception())
+
+    async def flush(self, user_id: int):
+        events = self.pending.pop(user_id, None)
+        if events:
+            await self.emit(user_id, events)
@@ -0,0 +1,119 @@
+import asyncio
+import functools
+import logging
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class ConnectionLimiter:
+    """
+    Token buckets per sid and per user for each limited event type,
+    plus a bounded queue per sid drained by a single worker. The guarded
+    call resolves to the handler's result, so Socket.IO acks still work.
+    """
+
+    def __init__(self, sid_limits: dict[str, tuple[float, float]], user_limits: dict[str, tuple[float, float]],
+                 queue_size: int, user_of: Callable[[str], Awaitable[Optional[int]]],
+                 reject: Callable[[str, str, str], Awaitable]):
+        self.sid_limits = sid_limits
+        self.user_limits = user_limits
+        self.queue_size = queue_size
+        self.user_of = user_of
+        self.reject = reject
+        self.buckets: dict[tuple, dict[str, TokenBucket]] = {}
+        self.queues: dict[str, asyncio.Queue] = {}
+        self.workers: dict[str, asyncio.Task] = {}
+        self.user_sids: dict[int, set[str]] = {}
+        self.throttled: Counter = Counter()
+        self.dropped: Counter = Counter()
+
+    def _allow(self, scope: str, key, event: str, limits: dict[str, tuple[float, float]]) -> bool:
+        limit = limits.get(event)
+        if limit is None:
+            return True
+        buckets = self.buckets.setdefault((scope, key), {})
+        bucket = buckets.get(event)
+        if bucket is None:
+            bucket = buckets[event] = TokenBucket(*limit)
+        return bucket.take()
+
+    def _queue(self, sid: str) -> asyncio.Queue:
+        queue = self.queues.get(sid)
+        if queue is None:
+            queue = self.queues[sid] = asyncio.Queue(maxsize=self.queue_size)
+            self.workers[sid] = asyncio.create_task(self._worker(queue))
+        return queue
+
+    @staticmethod
+    async def _worker(queue: asyncio.Queue):
+        while True:
+            handler, args, done = await queue.get()
+            result = None
+            try:
+                result = await handler(*args)
+            except Exception:
+                logger.exception("Socket event handler failed")
+            finally:
+                if not done.done():
+                    done.set_result(result)
+                queue.task_done()
+
+    def guard(self, event: str):
+        def decorator(handler):
+            @functools.wraps(handler)
+            async def wrapper(sid, *args):
+                user_id = await self.user_of(sid)
+                if user_id is not None:
+                    self.user_sids.setdefault(user_id, set()).add(sid)
+                if not self._allow("sid", sid, event, self.sid_limits) or (
+                        user_id is not None and not self._allow("user", user_id, event, self.user_limits)):
+                    self.throttled[event] += 1
+                    await self.reject(sid, event, "Rate limit exceeded")
+                    return
+                done = asyncio.get_running_loop().create_future()
+                try:
+                    self._queue(sid).put_nowait((handler, (sid, *args), done))
+                except asyncio.QueueFull:
+                    self.dropped[event] += 1
+                    await self.reject(sid, event, "Too many pending events")
+                    return
+                return await done
+            return wrapper
+        return decorator
+
+    def close(self, sid: str, user_id: Optional[int] = None):
+        worker = self.workers.pop(sid, None)
+        if worker:
+            worker.cancel()
+        queue = self.queues.pop(sid, None)
+        while queue is not None and not queue.empty():
+            _, _, done = queue.get_nowait()
+            done.set_result(None)
+        self.buckets.pop(("sid", sid), None)
+        sids = self.user_sids.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self.user_sids[user_id]
+                self.buckets.pop(("user", user_id), None)
@@ -0,0 +1,91 @@
+import asyncio
+import math
+from typing import Awaitable, Callable, Hashable
+
+
+class TimerWheel:
+    """Hashed timer wheel. Scheduling and cancelling are O(1), each tick expires one slot."""
+
+    def __init__(self, slots: int, tick: float):
+        self.tick = tick
+        self.slots: list[set] = [set() for _ in range(slots)]
+        self.position = 0
+        self.where: dict[Hashable, int] = {}
+
+    def schedule(self, key: Hashable, delay: float):
+        self.cancel(key)
+        ticks = min(max(1, math.ceil(delay / self.tick)), len(self.slots) - 1)
+        slot = (self.position + ticks) % len(self.slots)
+        self.slots[slot].add(key)
+        self.where[key] = slot
+
+    def cancel(self, key: Hashable):
+        slot = self.where.pop(key, None)
+        if slot is not None:
+            self.slots[slot].discard(key)
+
+    def advance(self) -> set:
+        self.position = (self.position + 1) % len(self.slots)
+        expired = self.slots[self.position]
+        self.slots[self.position] = set()
+        for key in expired:
+            del self.where[key]
+        return expired
+
+
+class TypingIndicators:
+    """
+    Ephemeral typing state, never persisted.
+    Changes are collected per chat and flushed at most once per interval.
+    """
+
+    def __init__(self, emit: Callable[[int, list[int]], Awaitable], interval: float = 0.5, ttl: float = 5.0):
+        self.emit = emit
+        self.interval = interval
+        self.ttl = ttl
+        self.wheel = TimerWheel(slots=math.ceil(ttl / interval) + 2, tick=interval)
+        self.typers: dict[int, set[int]] = {}
+        self.user_chats: dict[int, set[int]] = {}
+        self.dirty: set[int] = set()
+
+    def start(self, chat_id: int, user_id: int):
+        typers = self.typers.setdefault(chat_id, set())
+        if user_id not in typers:
+            typers.add(user_id)
+            self.user_chats.setdefault(user_id, set()).add(chat_id)
+            self.dirty.add(chat_id)
+        self.wheel.schedule((chat_id, user_id), self.ttl)
+
+    def stop(self, chat_id: int, user_id: int):
+        self.wheel.cancel((chat_id, user_id))
+        self._remove(chat_id, user_id)
+
+    def drop_user(self, user_id: int):
+        for chat_id in list(self.user_chats.get(user_id, ())):
+            self.stop(chat_id, user_id)
+
+    def _remove(self, chat_id: int, user_id: int):
+        typers = self.typers.get(chat_id)
+        if not typers or user_id not in typers:
+            return
+        typers.discard(user_id)
+        if not typers:
+            del self.typers[chat_id]
+        chats = self.user_chats[user_id]
+        chats.discard(chat_id)
+        if not chats:
+            del self.user_chats[user_id]
+        self.dirty.add(chat_id)
+
+    async def tick(self) -> int:
+        for chat_id, user_id in self.wheel.advance():
+            self._remove(chat_id, user_id)
+        dirty, self.dirty = self.dirty, set()
+        for chat_id in dirty:
+            await self.emit(chat_id, sorted(self.typers.get(chat_id, ())))
+        return len(dirty)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.tick()
@@ -0,0 +1,51 @@
+from typing import Awaitable, Callable, Optional
+
+try:
+    import msgpack
+except ImportError:  # listed in requirements.txt; without it clients asking for msgpack get slim JSON
+    msgpack = None
+
+# Payload variants, chosen per client in the connect auth: {"format": "msgpack"} or {"slim": true}.
+# "full" is the original payload with nested user and chat dicts. The variant a client got is
+# sent back to it in a "wire_format" event right after connecting.
+FULL, SLIM, MSGPACK = "full", "slim", "msgpack"
+VARIANTS = (FULL, SLIM, MSGPACK)
+
+
+def negotiate(auth: dict) -> str:
+    if auth.get("format") == MSGPACK and msgpack is not None:
+        return MSGPACK
+    return SLIM if auth.get("slim") or auth.get("format") == MSGPACK else FULL
+
+
+def room(base: str, variant: str) -> str:
+    """Clients of one variant share a room, so each payload is encoded once per emit."""
+    return base if variant == FULL else f"{base}.{variant}"
+
+
+def encode(variant: str, payload: dict):
+    return msgpack.packb(payload, use_bin_type=True) if variant == MSGPACK else payload
+
+
+class VariantEmitter:
+    """
+    Emits an event to every variant of a room that has members. Slim payloads carry ids
+    only (clients resolve users and chats from the dictionaries they already hold); the
+    full payload is built lazily, so its extra lookups only happen for old clients.
+    """
+
+    def __init__(self, sio):
+        self.sio = sio
+
+    def _occupied(self, base: str) -> list[str]:
+        rooms = self.sio.manager.rooms.get("/", {})
+        return [variant for variant in VARIANTS if rooms.get(room(base, variant))]
+
+    async def emit(self, event: str, base: str, slim: dict,
+                   full: Optional[Callable[[], Awaitable[dict]]] = None):
+        for variant in self._occupied(base):
+            if variant == FULL:
+                payload = await full() if full is not None else slim
+            else:
+                payload = encode(variant, slim)
+            await self.sio.emit(event, payload, room=room(base, variant))
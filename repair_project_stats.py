@@ -0,0 +1,5 @@
+import asyncio
+from database.stats import repair_stats
+
+if __name__ == "__main__":
+    print(asyncio.run(repair_stats()))
@@ -0,0 +1,18 @@
+import os
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+DOTENV = os.path.join(os.path.dirname(os.path.dirname(__file__)), "scheduler.env")
+
+
+class SchedulerSettings(BaseSettings):
+    model_config = SettingsConfigDict(
+        env_file=DOTENV,
+        env_file_encoding="utf-8"
+    )
+    REMINDER_LEAD_MINUTES: int = 60
+    REMINDER_HORIZON_HOURS: int = 24
+    LEASE_TTL_SECONDS: int = 30
+
+
+scheduler_conf = SchedulerSettings()
@@ -0,0 +1,31 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database.models import SchedulerLease
+from database.unit_of_work import scoped_session, commit
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+async def acquire_lease(name: str, owner: str, ttl: float) -> bool:
+    """Take or renew the named lease for ttl seconds. False while another worker holds it."""
+    now = datetime.now(timezone.utc)
+    async with scoped_session() as session:
+        insert = pg_insert if session.bind.dialect.name == "postgresql" else sqlite_insert
+        stmt = insert(SchedulerLease).values(name=name, owner=owner, expires_at=now + timedelta(seconds=ttl))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SchedulerLease.name],
+            set_={"owner": stmt.excluded.owner, "expires_at": stmt.excluded.expires_at},
+            where=or_(SchedulerLease.expires_at < now, SchedulerLease.owner == owner),
+        ).returning(SchedulerLease.owner)
+        holder = (await session.execute(stmt)).scalar()
+        await commit(session)
+    return holder == owner
@@ -0,0 +1,216 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import event, select, update, or_, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database.database_init import engine
+from database.models import Task, TaskStatus, TaskAssigned, User
+from database.unit_of_work import scoped_session, commit
+from scheduler.config import scheduler_conf
+from scheduler.lease import acquire_lease, worker_id
+
+logger = logging.getLogger("uvicorn.error")
+
+CHANNEL = "task_deadlines"
+LEASE_NAME = "deadline_reminders"
+
+# fire(task, [(user_id, email), ...])
+Fire = Callable[[dict, list[tuple[int, str]]], Awaitable[None]]
+
+
+def _aware(moment: datetime) -> datetime:
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+class DeadlineScheduler:
+    """
+    Fires one reminder per task deadline from an in-memory heap instead of polling the
+    tasks table. Only the worker holding the lease keeps the heap: it loads the deadlines
+    falling within the horizon, then follows task changes through LISTEN/NOTIFY (or the
+    local commit hook where NOTIFY is not available). Each reminder is claimed with a
+    conditional update of tasks.reminded_for, so a lease handover never sends it twice.
+    """
+
+    def __init__(self, lead: timedelta, horizon: timedelta, lease_ttl: float):
+        self.lead = lead
+        self.horizon = horizon
+        self.lease_ttl = lease_ttl
+        self.owner = worker_id()
+        self.heap: list[tuple[datetime, int, datetime]] = []
+        self.entries: dict[int, tuple[datetime, datetime]] = {}  # task id -> (fire at, deadline)
+        self.changed_ids: set[int] = set()
+        self.wakeup = asyncio.Event()
+        self.leader = False
+        self.loaded_until: Optional[datetime] = None
+
+    def changed(self, task_id: int):
+        """A task's deadline, status or existence changed; reloaded by the firing loop."""
+        if self.leader:
+            self.changed_ids.add(task_id)
+            self.wakeup.set()
+
+    def _schedule(self, task_id: int, time_end: datetime):
+        time_end = _aware(time_end)
+        fire_at = time_end - self.lead
+        self.entries[task_id] = (fire_at, time_end)
+        heapq.heappush(self.heap, (fire_at, task_id, time_end))
+
+    def _pending(self):
+        return (Task.status != TaskStatus.completed,
+                or_(Task.reminded_for.is_(None), Task.reminded_for != Task.time_end))
+
+    async def _load(self, now: datetime):
+        """Schedule deadlines up to the end of the next horizon (an index range scan on time_end)."""
+        until = now + self.horizon
+        query = select(Task.id, Task.time_end).where(Task.time_end > now, Task.time_end <= until + self.lead,
+                                                     *self._pending())
+        async with scoped_session() as session:
+            rows = (await session.execute(query)).all()
+        for row in rows:
+            if self.entries.get(row.id, (None, None))[1] != _aware(row.time_end):
+                self._schedule(row.id, row.time_end)
+        self.loaded_until = until
+
+    async def _reload(self, task_ids: set[int]):
+        query = select(Task.id, Task.time_end).where(Task.id.in_(task_ids), *self._pending())
+        async with scoped_session() as session:
+            rows = {row.id: row.time_end for row in await session.execute(query)}
+        for task_id in task_ids:
+            self.entries.pop(task_id, None)
+            time_end = rows.get(task_id)
+            if time_end is not None and _aware(time_end) - self.lead <= self.loaded_until:
+                self._schedule(task_id, time_end)
+
+    async def _claim(self, task_id: int, time_end: datetime, session: AsyncSession) -> Optional[dict]:
+        claim = (update(Task)
+                 .where(Task.id == task_id, Task.time_end == time_end, *self._pending())
+                 .values(reminded_for=Task.time_end)
+                 .returning(Task.id, Task.name, Task.project_id, Task.time_end))
+        row = (await session.execute(claim)).first()
+        await commit(session)
+        if row is None:
+            return None
+        return {"task_id": row.id, "name": row.name, "project_id": row.project_id,
+                "time_end": _aware(row.time_end).isoformat()}
+
+    async def _fire_due(self, fire: Fire, now: datetime):
+        while self.heap and self.heap[0][0] <= now:
+            fire_at, task_id, time_end = heapq.heappop(self.heap)
+            if self.entries.get(task_id) != (fire_at, time_end):
+                continue
+            del self.entries[task_id]
+            async with scoped_session() as session:
+                task = await self._claim(task_id, time_end, session)
+                if task is None:
+                    continue
+                users = (await session.execute(
+                    select(User.id, User.email).join(TaskAssigned, TaskAssigned.user_id == User.id)
+                    .where(TaskAssigned.task_id == task_id)
+                )).all()
+            try:
+                await fire(task, [(user.id, user.email) for user in users])
+            except Exception:
+                logger.exception("Deadline reminder for task %s failed", task_id)
+
+    async def _fire_loop(self, fire: Fire):
+        while True:
+            now = datetime.now(timezone.utc)
+            if self.changed_ids:
+                task_ids, self.changed_ids = self.changed_ids, set()
+                await self._reload(task_ids)
+            if now >= self.loaded_until - self.horizon / 2:
+                await self._load(now)
+            await self._fire_due(fire, now)
+            timeout = (self.loaded_until - self.horizon / 2 - now).total_seconds()
+            if self.heap:
+                timeout = min(timeout, (self.heap[0][0] - now).total_seconds())
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(timeout, 0.0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _listen(self):
+        """Hold a connection LISTENing for deadline changes while leading (Postgres only)."""
+        if engine.dialect.name != "postgresql":
+            await asyncio.Future()
+        async with engine.connect() as conn:
+            raw = (await conn.get_raw_connection()).driver_connection
+
+            def callback(_conn, _pid, _channel, payload: str):
+                try:
+                    task_id = int(payload)
+                except ValueError:
+                    logger.warning("Ignoring malformed %s notification %r", CHANNEL, payload)
+                    return
+                self.changed(task_id)
+
+            await raw.add_listener(CHANNEL, callback)
+            try:
+                await asyncio.Future()
+            finally:
+                await raw.remove_listener(CHANNEL, callback)
+
+    def _step_down(self, tasks: list[asyncio.Task]):
+        for task in tasks:
+            task.cancel()
+        tasks.clear()
+        self.leader = False
+        self.heap.clear()
+        self.entries.clear()
+        self.changed_ids.clear()
+
+    async def run(self, fire: Fire):
+        """Compete for the lease and run the heap while holding it."""
+        tasks: list[asyncio.Task] = []
+        try:
+            while True:
+                try:
+                    holding = await acquire_lease(LEASE_NAME, self.owner, self.lease_ttl)
+                except Exception:
+                    logger.exception("Deadline scheduler lease renewal failed")
+                    holding = False
+                if holding and (not self.leader or any(task.done() for task in tasks)):
+                    self._step_down(tasks)
+                    self.leader = True
+                    self.loaded_until = datetime.now(timezone.utc) - self.horizon
+                    tasks.extend([asyncio.create_task(self._listen()), asyncio.create_task(self._fire_loop(fire))])
+                    logger.info("Deadline scheduler leading as %s", self.owner)
+                elif not holding and self.leader:
+                    self._step_down(tasks)
+                await asyncio.sleep(self.lease_ttl / 3)
+        finally:
+            self._step_down(tasks)
+
+
+deadline_scheduler = DeadlineScheduler(lead=timedelta(minutes=scheduler_conf.REMINDER_LEAD_MINUTES),
+                                       horizon=timedelta(hours=scheduler_conf.REMINDER_HORIZON_HOURS),
+                                       lease_ttl=scheduler_conf.LEASE_TTL_SECONDS)
+
+
+async def deadline_changed(session: AsyncSession, task_id: int):
+    """
+    Tell the lease holder a task's deadline may have moved. NOTIFY is transactional on
+    Postgres, so it is only delivered if the change commits; elsewhere the id is handed
+    to the local scheduler once the session commits.
+    """
+    if session.bind.dialect.name == "postgresql":
+        await session.execute(select(func.pg_notify(CHANNEL, str(task_id))))
+    else:
+        session.info.setdefault("deadline_changes", set()).add(task_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _forward_deadline_changes(session):
+    for task_id in session.info.pop("deadline_changes", ()):
+        deadline_scheduler.changed(task_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_deadline_changes(session):
+    session.info.pop("deadline_changes", None)
@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from security.config import security_conf
 from database import schemas
 from database.crud import AsyncORM
+from database.database_init import current_user_id
 import jwt
 from jwt import PyJWTError
 
@@ -44,6 +45,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     user = await AsyncORM.get_user_by_email(email=token_data.email)
     if user is None:
         raise credentials_exception
+    current_user_id.set(user.id)
     return user
 
 
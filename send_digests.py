@@ -0,0 +1,5 @@
+import asyncio
+from mail.digests import send_digests
+
+if __name__ == "__main__":
+    print(asyncio.run(send_digests()))
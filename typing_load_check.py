@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+
+from realtime.typing_events import TypingIndicators
+
+
+async def check(args) -> dict:
+    """
+    Drive TypingIndicators with `typers` users spread over `chats` chats, each sending a typing
+    event every `every` seconds, then let everyone stop or time out. Fails unless every chat got
+    at most one emit per tick, emits stayed interval apart and the last one cleared the chat.
+    """
+    emits: dict[int, list[tuple[int, float, list[int]]]] = defaultdict(list)
+    ticks = 0
+
+    async def emit(chat_id: int, users: list[int]):
+        emits[chat_id].append((ticks, time.monotonic(), users))
+
+    indicators = TypingIndicators(emit, interval=args.interval, ttl=args.ttl)
+
+    async def run():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(indicators.interval)
+            ticks += 1
+            await indicators.tick()
+
+    users = [(user_id, user_id % args.chats) for user_id in range(args.typers)]
+    events = 0
+    runner = asyncio.create_task(run())
+    try:
+        deadline = time.monotonic() + args.duration
+        while time.monotonic() < deadline:
+            for user_id, chat_id in users:
+                if random.random() < 0.05:
+                    indicators.stop(chat_id, user_id)
+                else:
+                    indicators.start(chat_id, user_id)
+                events += 1
+            await asyncio.sleep(args.every)
+        for user_id, chat_id in users[::2]:
+            indicators.stop(chat_id, user_id)
+        await asyncio.sleep(args.ttl + 3 * args.interval)
+    finally:
+        runner.cancel()
+
+    for chat_id, sent in emits.items():
+        seen = [tick for tick, _, _ in sent]
+        assert len(seen) == len(set(seen)), f"chat {chat_id}: more than one emit in a tick"
+        gaps = [later - earlier for (_, earlier, _), (_, later, _) in zip(sent, sent[1:])]
+        assert not gaps or min(gaps) >= args.interval * 0.9, f"chat {chat_id}: emits {min(gaps):.3f}s apart"
+        assert sent[-1][2] == [], f"chat {chat_id}: typers left after everyone stopped"
+    assert len(emits) == min(args.chats, args.typers), "some chats never got an emit"
+    total = sum(len(sent) for sent in emits.values())
+    return {"typing_events": events, "emits": total, "ticks": ticks,
+            "max_emits_per_chat": max(len(sent) for sent in emits.values()),
+            "events_per_emit": round(events / total, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load check for the coalesced typing indicators")
+    parser.add_argument("--typers", type=int, default=1000)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--every", type=float, default=0.05, help="seconds between one user's typing events")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--interval", type=float, default=0.5)
+    parser.add_argument("--ttl", type=float, default=2.0)
+    print(asyncio.run(check(parser.parse_args())))
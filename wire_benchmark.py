@@ -0,0 +1,51 @@
+import argparse
+import timeit
+from datetime import datetime, timezone
+
+from socketio import packet
+
+from realtime.wire import FULL, SLIM, MSGPACK, encode, msgpack
+
+
+def sample_payloads(text: str) -> tuple[dict, dict]:
+    """A new_message payload as message_handler sends it, full and slim."""
+    timestamp = datetime(2026, 10, 19, 12, 30, tzinfo=timezone.utc).isoformat()
+    user = {"email": "jane.doe@example.com", "first_name": "Jane", "second_name": "Doe",
+            "photo": "uploads/avatar_5f2c9a1e0b7d4c3a8e6f1d2b9c0a7e4f.png", "id": 1042}
+    chat = {"name": "Release planning", "type": "group", "id": 311,
+            "photo": "uploads/chat_9d8c7b6a5f4e3d2c1b0a9f8e7d6c5b4a.png"}
+    full = {"user": user, "chat": chat, "message": text, "message_id": 8812345, "type": "text",
+            "timestamp": timestamp}
+    slim = {"id": 8812345, "chat_id": 311, "user_id": 1042, "type": "text", "content": text,
+            "timestamp": timestamp}
+    return full, slim
+
+
+def wire_size(data) -> int:
+    """Bytes of the Socket.IO packet(s), attachments included."""
+    encoded = packet.Packet(packet.EVENT, data=["new_message", data], namespace="/").encode()
+    parts = encoded if isinstance(encoded, list) else [encoded]
+    return sum(len(part.encode() if isinstance(part, str) else part) for part in parts)
+
+
+def measure(variant: str, payload: dict, number: int) -> tuple[int, float]:
+    def run():
+        return packet.Packet(packet.EVENT, data=["new_message", encode(variant, payload)], namespace="/").encode()
+    seconds = min(timeit.repeat(run, number=number, repeat=5)) / number
+    return wire_size(encode(variant, payload)), seconds * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Size and encode time of one new_message per payload variant")
+    parser.add_argument("--text", default="Let's move the release review to Thursday, 3pm works for everyone?")
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--members", type=int, default=1000, help="room size for the bytes-per-emit column")
+    args = parser.parse_args()
+    full, slim = sample_payloads(args.text)
+    variants = [(FULL, full), (SLIM, slim)] + ([(MSGPACK, slim)] if msgpack is not None else [])
+    for variant, payload in variants:
+        size, micros = measure(variant, payload, args.number)
+        print(f"{variant:8} {size:5d} bytes  {micros:6.2f} us/encode  {size * args.members / 1000:8.1f} KB per emit "
+              f"to {args.members} members")
+    if msgpack is None:
+        print("msgpack is not installed, MessagePack clients get slim JSON")